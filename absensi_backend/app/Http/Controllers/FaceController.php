@@ -43,6 +43,15 @@ public function verifyFace(Request $request)
 
             $json = $resp->json();
 
+            // FastAPI penuh (antrean encoder) -> teruskan 503 supaya client retry
+            if ($resp->status() === 503) {
+                return response()->json([
+                    'success' => false,
+                    'status'  => 'busy',
+                    'message' => 'Server pengenalan wajah sedang sibuk, coba lagi sebentar.',
+                ], 503)->header('Retry-After', $resp->header('Retry-After') ?: '2');
+            }
+
             if (!$resp->successful() || !($json['success'] ?? false)) {
                 return response()->json([
                     'success' => false,
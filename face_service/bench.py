@@ -0,0 +1,320 @@
+# bench.py — benchmark hot path face_service, hasil JSON supaya bisa dibandingkan antar run
+#
+#   python bench.py match  --sizes 100,1000,10000,100000
+#   python bench.py ann    --sizes 10000,100000 --nprobes 1,2,4,8,16,32
+#   python bench.py quant  --sizes 10000,100000
+#   python bench.py load   --sizes 1000,10000 --legacy-max 10000
+#   python bench.py decode --face faces/Dinda/dinda.jpg
+#   python bench.py load-test --url http://127.0.0.1:8001/verify-face --image x.jpg -c 16 -n 500
+#   python bench.py all --out results/2025-10-30.json
+#
+# Semua data sintetis pakai seed tetap (--seed), jadi run bisa diulang.
+import argparse, io, json, os, platform, sys, tempfile, time, uuid
+import urllib.request, urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+from PIL import Image
+
+import main
+from gallery import DIM, Gallery, int8_scale
+from store import PackedStore, PACKED_DIRNAME
+
+RESOLUTIONS = [(640, 480), (1280, 960), (1920, 1080), (4000, 3000)]
+
+
+# ---------- Helpers ----------
+def _stats(samples: List[float]) -> Dict[str, float]:
+    a = np.asarray(samples, dtype=np.float64) * 1000.0  # ms
+    return {
+        "n": int(a.size),
+        "mean_ms": float(a.mean()),
+        "p50_ms": float(np.percentile(a, 50)),
+        "p95_ms": float(np.percentile(a, 95)),
+        "p99_ms": float(np.percentile(a, 99)),
+        "min_ms": float(a.min()),
+        "max_ms": float(a.max()),
+    }
+
+def _timeit(fn: Callable[[], object], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    out = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t)
+    return _stats(out)
+
+def _synthetic_gallery(n_vecs: int, per_person: int, rng: np.random.Generator):
+    # encoding dlib kira-kira N(0, 0.1) per dimensi; cukup untuk timing
+    n_persons = max(n_vecs // per_person, 1)
+    centers = rng.normal(0, 0.1, (n_persons, DIM)).astype(np.float32)
+    pid = np.arange(n_vecs) % n_persons
+    vecs = centers[pid] + rng.normal(0, 0.03, (n_vecs, DIM)).astype(np.float32)
+    names = [f"p{i:06d}" for i in pid]
+    return names, vecs, centers
+
+def _image_corpus(face: str, rng: np.random.Generator) -> Dict[str, bytes]:
+    if face:
+        base = Image.open(face).convert("RGB")
+    else:
+        h, w = 480, 640
+        yy, xx = np.mgrid[0:h, 0:w]
+        img = np.stack([xx * 255 // w, yy * 255 // h, (xx + yy) * 255 // (w + h)], axis=-1)
+        img = img + rng.integers(0, 32, img.shape)
+        base = Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+    corpus = {}
+    for w, h in RESOLUTIONS:
+        im = base.resize((w, h), Image.BICUBIC)
+        for fmt in ("JPEG", "PNG"):
+            b = io.BytesIO()
+            im.save(b, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+            corpus[f"{w}x{h}.{fmt.lower()}"] = b.getvalue()
+    return corpus
+
+
+# ---------- Suites ----------
+def bench_match(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    out = {}
+    for n in args.sizes:
+        names, vecs, centers = _synthetic_gallery(n, args.per_person, rng)
+        main._galleries[main.DEFAULT_GROUP] = Gallery.from_rows(names, vecs)
+        probes = centers[rng.integers(0, len(centers), args.repeat)] + \
+            rng.normal(0, 0.03, (args.repeat, DIM)).astype(np.float32)
+        probes = probes.astype(np.float64)
+        it = iter(probes)
+        out[str(n)] = _timeit(lambda: main._best_match(next(it, probes[0])), args.repeat)
+        print(f"[BENCH] match n={n}: p50={out[str(n)]['p50_ms']:.3f}ms", file=sys.stderr)
+    return out
+
+def _decision(best: float, second: float) -> str:
+    if best > main.TOLERANCE:
+        return "unknown"
+    if (second - best) < main.MARGIN_GAP:
+        return "ambiguous"
+    return "matched"
+
+def bench_ann(args) -> dict:
+    # recall vs latency IVF terhadap exact _best_match, per nprobe
+    rng = np.random.default_rng(args.seed)
+    out = {}
+    for n in args.sizes:
+        names, vecs, centers = _synthetic_gallery(n, args.per_person, rng)
+        g = Gallery.from_rows(names, vecs)
+        t = time.perf_counter()
+        g.build_index(nlist=main.ANN_NLIST)
+        build_s = time.perf_counter() - t
+        q = min(args.repeat, 500)
+        probes = (centers[rng.integers(0, len(centers), q)] +
+                  rng.normal(0, 0.03, (q, DIM)).astype(np.float32)).astype(np.float64)
+        exact, t_exact = [], []
+        for c in probes:
+            t = time.perf_counter()
+            exact.append(g.match(c, exact=True))
+            t_exact.append(time.perf_counter() - t)
+        res = {"nlist": g.index.nlist, "build_s": build_s, "exact": _stats(t_exact), "nprobe": {}}
+        for npb in args.nprobes:
+            g.index.nprobe = npb
+            same_top1 = same_decision = same_values = 0
+            t_ann = []
+            for c, e in zip(probes, exact):
+                t = time.perf_counter()
+                a = g.match(c)
+                t_ann.append(time.perf_counter() - t)
+                same_top1 += a[0] == e[0]
+                same_values += a == e
+                same_decision += _decision(a[1], a[2]) == _decision(e[1], e[2])
+            res["nprobe"][str(npb)] = {
+                "recall_top1": same_top1 / q, "identical_result": same_values / q,
+                "decision_agreement": same_decision / q, "latency": _stats(t_ann),
+            }
+            print(f"[BENCH] ann n={n} nprobe={npb}: recall={same_top1 / q:.3f} "
+                  f"p50={res['nprobe'][str(npb)]['latency']['p50_ms']:.3f}ms "
+                  f"(exact {res['exact']['p50_ms']:.3f}ms)", file=sys.stderr)
+        out[str(n)] = res
+    return out
+
+def bench_quant(args) -> dict:
+    # memori per 10k vektor + dampak akurasi float16/int8 terhadap float32
+    rng = np.random.default_rng(args.seed)
+    out = {}
+    for n in args.sizes:
+        names, vecs, centers = _synthetic_gallery(n, args.per_person, rng)
+        q = min(args.repeat, 500)
+        # campuran probe: orang terdaftar dengan noise bervariasi + orang asing
+        noise = rng.uniform(0.01, 0.06, (q, 1)).astype(np.float32)
+        probes = centers[rng.integers(0, len(centers), q)] + rng.normal(0, 1, (q, DIM)).astype(np.float32) * noise
+        probes[: q // 4] = rng.normal(0, 0.1, (q // 4, DIM))
+        probes = probes.astype(np.float64)
+        ref = Gallery.from_rows(names, vecs)
+        truth = [ref.match(c) for c in probes]
+        res = {}
+        for dt in ("float32", "float16", "int8"):
+            g = Gallery.from_rows(names, vecs, dtype=dt, scale=int8_scale(vecs) if dt == "int8" else None,
+                                  src=np.arange(n))
+            g.fetch_exact = lambda rows: vecs[rows]
+            row = {"bytes_per_10k": g.nbytes() / n * 10000}
+            for label, recheck in (("plain", None), ("recheck", main._near_boundary)):
+                got, ts = [], []
+                for c in probes:
+                    t = time.perf_counter()
+                    got.append(g.match(c, recheck=recheck))
+                    ts.append(time.perf_counter() - t)
+                err = [abs(a[1] - b[1]) for a, b in zip(got, truth)]
+                row[label] = {
+                    "decision_agreement": float(np.mean([_decision(a[1], a[2]) == _decision(b[1], b[2])
+                                                         for a, b in zip(got, truth)])),
+                    "top1_agreement": float(np.mean([a[0] == b[0] for a, b in zip(got, truth)])),
+                    "max_abs_err_best": float(np.max(err)), "mean_abs_err_best": float(np.mean(err)),
+                    "latency": _stats(ts),
+                }
+            res[dt] = row
+            print(f"[BENCH] quant n={n} {dt}: {row['bytes_per_10k'] / 2**20:.2f} MiB/10k, "
+                  f"decision={row['plain']['decision_agreement']:.3f} "
+                  f"(recheck {row['recheck']['decision_agreement']:.3f}), "
+                  f"p50={row['plain']['latency']['p50_ms']:.3f}ms", file=sys.stderr)
+        out[str(n)] = res
+    return out
+
+def bench_load(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    out = {}
+    saved = (main.EMB_DIR, dict(main._stores), main.EMB_FORMAT)
+    try:
+        for n in args.sizes:
+            names, vecs, _ = _synthetic_gallery(n, args.per_person, rng)
+            with tempfile.TemporaryDirectory() as tmp:
+                emb = Path(tmp)
+                st = PackedStore(emb / PACKED_DIRNAME)
+                st.append(names, [str(i) for i in range(n)], vecs)
+                main.EMB_DIR, main._stores, main.EMB_FORMAT = emb, {main.DEFAULT_GROUP: st}, "packed"
+                res = {"packed": _timeit(main.load_embeddings, args.load_repeat)}
+                if n <= args.legacy_max:
+                    for i, (name, v) in enumerate(zip(names, vecs)):
+                        d = emb / name
+                        d.mkdir(exist_ok=True)
+                        np.save(str(d / f"{i}.npy"), v.astype(np.float64))
+                    main.EMB_FORMAT = "npy"
+                    res["npy"] = _timeit(main.load_embeddings, args.load_repeat)
+                out[str(n)] = res
+                print(f"[BENCH] load n={n}: " + ", ".join(f"{k} p50={v['p50_ms']:.1f}ms" for k, v in res.items()),
+                      file=sys.stderr)
+    finally:
+        main.EMB_DIR, main._stores, main.EMB_FORMAT = saved
+    return out
+
+def bench_decode(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    out = {}
+    for label, raw in _image_corpus(args.face, rng).items():
+        img = main._to_rgb_uint8(raw)
+        res = {
+            "bytes": len(raw),
+            "to_rgb_full": _timeit(lambda: main._to_rgb_uint8(raw), args.repeat),
+            "to_rgb_draft": _timeit(lambda: main._to_rgb_uint8(raw, min_width=main.MAX_WIDTH), args.repeat),
+            "resize_np": _timeit(lambda: main._resize_np(img, main.MAX_WIDTH), args.repeat),
+        }
+        if not args.skip_encode:
+            res["encode_jit1"] = _timeit(lambda: main._encode_image_bytes(raw, jitters=1), args.encode_repeat)
+            res["encode_found_face"] = main._encode_image_bytes(raw, jitters=1) is not None
+        out[label] = res
+        print(f"[BENCH] decode {label}: draft p50={res['to_rgb_draft']['p50_ms']:.1f}ms", file=sys.stderr)
+    return out
+
+def _multipart(field: str, filename: str, data: bytes):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+def bench_load_test(args) -> dict:
+    data = Path(args.image).read_bytes()
+    body, ctype = _multipart("image", Path(args.image).name, data)
+
+    def one(_):
+        req = urllib.request.Request(args.url, data=body, headers={"Content-Type": ctype}, method="POST")
+        t = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=args.timeout) as r:
+                r.read()
+                code = r.status
+        except urllib.error.HTTPError as e:
+            code = e.code
+        except Exception:
+            code = 0  # timeout / koneksi gagal
+        return code, time.perf_counter() - t
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        results = list(ex.map(one, range(args.requests)))
+    wall = time.perf_counter() - t0
+
+    codes: Dict[str, int] = {}
+    for c, _ in results:
+        codes[str(c)] = codes.get(str(c), 0) + 1
+    ok = [dt for c, dt in results if c == 200]
+    out = {
+        "url": args.url, "concurrency": args.concurrency, "requests": args.requests,
+        "image_bytes": len(data), "wall_s": wall,
+        "throughput_rps": len(results) / wall if wall else 0.0,
+        "status": codes,
+        "latency_all": _stats([dt for _, dt in results]),
+        "latency_200": _stats(ok) if ok else None,
+    }
+    print(f"[BENCH] load-test: {out['throughput_rps']:.1f} req/s p99={out['latency_all']['p99_ms']:.0f}ms",
+          file=sys.stderr)
+    return out
+
+
+SUITES = {"match": bench_match, "ann": bench_ann, "quant": bench_quant, "load": bench_load, "decode": bench_decode, "load-test": bench_load_test}
+
+def _meta() -> dict:
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "numpy": np.__version__, "cpu_count": os.cpu_count(),
+        "config": dict(max_width=main.MAX_WIDTH, upsample=main.UPSAMPLE, model=main.MODEL,
+                       jitters=main.ENC_JITTERS, tolerance=main.TOLERANCE, margin_gap=main.MARGIN_GAP),
+    }
+
+def main_cli(argv=None):
+    ap = argparse.ArgumentParser(description="face_service benchmarks (JSON output)")
+    ap.add_argument("suite", choices=list(SUITES) + ["all"])
+    ap.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[100, 1000, 10000, 100000])
+    ap.add_argument("--per-person", type=int, default=5)
+    ap.add_argument("--nprobes", type=lambda s: [int(x) for x in s.split(",")], default=[1, 2, 4, 8, 16, 32])
+    ap.add_argument("--repeat", type=int, default=200)
+    ap.add_argument("--load-repeat", type=int, default=3)
+    ap.add_argument("--encode-repeat", type=int, default=5)
+    ap.add_argument("--legacy-max", type=int, default=10000, help="layout .npy lama hanya sampai ukuran ini")
+    ap.add_argument("--face", default="", help="foto wajah untuk korpus decode/encode (default: gambar sintetis)")
+    ap.add_argument("--skip-encode", action="store_true")
+    ap.add_argument("--url", default="http://127.0.0.1:8001/verify-face")
+    ap.add_argument("--image", default="")
+    ap.add_argument("-c", "--concurrency", type=int, default=8)
+    ap.add_argument("-n", "--requests", type=int, default=200)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--out", default="", help="tulis JSON ke file (default stdout)")
+    args = ap.parse_args(argv)
+
+    names = [s for s in SUITES if s != "load-test"] if args.suite == "all" else [args.suite]
+    if args.suite == "all" and args.image:
+        names.append("load-test")
+    if "load-test" in names and not args.image:
+        ap.error("load-test butuh --image")
+
+    result = {"meta": _meta(), "results": {n: SUITES[n](args) for n in names}}
+    text = json.dumps(result, indent=2)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main_cli()
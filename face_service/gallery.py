@@ -0,0 +1,499 @@
+# gallery.py — matrix galeri untuk matching vektor wajah (dipakai main.py)
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DIM = 128          # panjang encoding face_recognition/dlib
+_RECHECK_TOP = 4   # jumlah orang teratas yang dihitung ulang secara exact (float64)
+_CHUNK = 8192      # baris per blok saat galeri compact di-cast ke float32
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+# ---------- Quantization (mode compact) ----------
+def int8_scale(vecs: np.ndarray, headroom: float = 1.1) -> np.ndarray:
+    # skala per dimensi: max|x| * headroom -> 127; default kalau belum ada data
+    if not len(vecs):
+        return np.full(DIM, 0.5 / 127.0, dtype=np.float32)
+    amax = np.abs(np.asarray(vecs, dtype=np.float32)).max(axis=0) * headroom
+    return (np.maximum(amax, 1e-6) / 127.0).astype(np.float32)
+
+
+def quantize(vecs: np.ndarray, dtype, scale: Optional[np.ndarray] = None) -> np.ndarray:
+    x = np.asarray(vecs, dtype=np.float32)
+    if dtype == np.int8:
+        return np.clip(np.rint(x / scale), -127, 127).astype(np.int8)
+    return x.astype(dtype)
+
+
+def dequantize(q: np.ndarray, scale: Optional[np.ndarray] = None) -> np.ndarray:
+    if q.dtype == np.int8:
+        return q.astype(np.float32) * scale
+    return q.astype(np.float32, copy=False)
+
+
+class Gallery:
+    # Semua vektor dalam satu matrix (N, DIM) yang dipre-alokasi, plus array
+    # person-id paralel. Default float32: encoding dlib aslinya float32, jadi
+    # tidak ada nilai yang berubah. Mode compact (float16 / int8 dengan skala
+    # per dimensi) memotong memori 2x / 4x; ranking dihitung langsung dari
+    # bentuk compact, dan kalau fetch_exact tersedia hasil di dekat batas
+    # keputusan bisa dicek ulang dari float32 asli (lihat match(recheck=...)).
+    def __init__(self, dim: int = DIM, capacity: int = 1024, dtype: str = "float32",
+                 scale: Optional[np.ndarray] = None):
+        self.dim = dim
+        self.n = 0
+        self.dtype = DTYPES[dtype]
+        self.scale = None
+        if self.dtype == np.int8:
+            self.scale = np.asarray(scale if scale is not None else int8_scale([]), dtype=np.float32)
+        cap = max(capacity, 1)
+        self.vecs = np.empty((cap, dim), dtype=self.dtype)
+        self.sqnorm = np.empty(cap, dtype=np.float32)
+        self.pid = np.empty(cap, dtype=np.int32)
+        self.src = np.empty(cap, dtype=np.int64)  # nomor baris di store (-1 = tidak ada)
+        self.names: List[str] = []          # pid -> nama
+        self._pid_of: Dict[str, int] = {}   # nama -> pid
+        self._segments = None               # cache (order, starts, ends, seg_pid)
+        self.index: Optional["IVFIndex"] = None  # opsional, lihat build_index
+        self.fetch_exact: Optional[Callable[[np.ndarray], np.ndarray]] = None  # src rows -> float32
+        self.mapped = False                 # vecs = memmap store (read-only), lihat from_mapped
+
+    @classmethod
+    def from_rows(cls, names: List[str], vecs: np.ndarray, dim: int = DIM, dtype: str = "float32",
+                  scale: Optional[np.ndarray] = None, src: Optional[np.ndarray] = None) -> "Gallery":
+        # satu baris per vektor; pid diberikan sesuai urutan kemunculan nama.
+        # vecs boleh float32 atau sudah dalam dtype compact yang sama.
+        g = cls(dim=dim, capacity=len(names), dtype=dtype, scale=scale)
+        pid = np.empty(len(names), dtype=np.int32)
+        for i, name in enumerate(names):
+            p = g._pid_of.get(name)
+            if p is None:
+                p = g._pid_of[name] = len(g.names)
+                g.names.append(name)
+            pid[i] = p
+        arr = np.asarray(vecs).reshape(-1, dim)
+        g.n = len(arr)
+        g.vecs[:g.n] = arr if arr.dtype == g.dtype else quantize(arr, g.dtype, g.scale)
+        g.sqnorm[:g.n] = g._norms(0, g.n)
+        g.pid[:g.n] = pid
+        g.src[:g.n] = -1 if src is None else src
+        return g
+
+    @classmethod
+    def from_mapped(cls, names: List[str], alive: np.ndarray, mm: np.ndarray, dim: int = DIM,
+                    dtype: str = "float32", scale: Optional[np.ndarray] = None) -> "Gallery":
+        # Matrix langsung di atas memmap store (semua baris, termasuk yang
+        # sudah di-tombstone): beberapa worker berbagi page cache yang sama.
+        # Baris mati diberi pid -1 dan dilewati saat matching. Yang privat
+        # per proses hanya sqnorm/pid/src (16 byte per baris).
+        g = cls(dim=dim, capacity=1, dtype=dtype, scale=scale)
+        g.mapped = True
+        g.vecs = mm
+        g.n = len(mm)
+        g.pid = np.full(g.n, -1, dtype=np.int32)
+        for i in np.flatnonzero(alive):
+            p = g._pid_of.get(names[i])
+            if p is None:
+                p = g._pid_of[names[i]] = len(g.names)
+                g.names.append(names[i])
+            g.pid[i] = p
+        g.sqnorm = g._norms(0, g.n)
+        g.src = np.arange(g.n, dtype=np.int64)
+        return g
+
+    def extend_mapped(self, mm: np.ndarray, names: List[str]) -> "Gallery":
+        # snapshot baru: baris [n, len(mm)) baru di-append ke store oleh proses mana pun
+        g = self._clone()
+        s, e = self.n, len(mm)
+        g.vecs, g.n = mm, e
+        pid = np.empty(e - s, dtype=np.int32)
+        for i, name in enumerate(names):
+            p = g._pid_of.get(name)
+            if p is None:
+                p = g._pid_of[name] = len(g.names)
+                g.names.append(name)
+            pid[i] = p
+        g.pid = np.concatenate([self.pid[:s], pid])
+        g.sqnorm = np.concatenate([self.sqnorm[:s], g._norms(s, e)])
+        g.src = np.arange(e, dtype=np.int64)
+        if g.index is not None:
+            g.index.add(np.arange(s, e), g._rows_f32(slice(s, e)))
+        return g
+
+    def __len__(self) -> int:
+        return self.n
+
+    @property
+    def num_persons(self) -> int:
+        return len(self._pid_of)
+
+    @property
+    def compact(self) -> bool:
+        return self.dtype != np.float32
+
+    def persons(self) -> List[str]:
+        return [n for n in self.names if n is not None]
+
+    def nbytes(self) -> int:
+        # memori yang dipakai baris terisi (vektor + norm + pid + src)
+        per_row = self.vecs.itemsize * self.dim + self.sqnorm.itemsize + self.pid.itemsize + self.src.itemsize
+        return self.n * per_row
+
+    def _rows_f32(self, idx) -> np.ndarray:
+        return dequantize(self.vecs[idx], self.scale)
+
+    def _norms(self, s: int, e: int) -> np.ndarray:
+        out = np.empty(e - s, dtype=np.float32)
+        for b in range(s, e, _CHUNK):
+            x = self._rows_f32(slice(b, min(b + _CHUNK, e)))
+            out[b - s:b - s + len(x)] = np.einsum("ij,ij->i", x, x)
+        return out
+
+    def _dots(self, c32: np.ndarray) -> np.ndarray:
+        # c32: (DIM,) satu probe -> (N,), atau (DIM, B) batch -> (N, B)
+        if not self.compact:
+            return self.vecs[:self.n] @ c32
+        # compact: q·(c*scale) == (q*scale)·c, cast per blok supaya temp kecil
+        cs = c32 * self.scale.reshape((-1,) + (1,) * (c32.ndim - 1)) if self.scale is not None else c32
+        out = np.empty((self.n,) + c32.shape[1:], dtype=np.float32)
+        for b in range(0, self.n, _CHUNK):
+            e = min(b + _CHUNK, self.n)
+            out[b:e] = self.vecs[b:e].astype(np.float32) @ cs
+        return out
+
+    def _reserve(self, extra: int):
+        need = self.n + extra
+        cap = self.vecs.shape[0]
+        if need <= cap:
+            return
+        cap = max(need, cap * 2)
+        for attr in ("vecs", "sqnorm", "pid", "src"):
+            old = getattr(self, attr)
+            new = np.empty((cap,) + old.shape[1:], dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, attr, new)
+
+    def add(self, name: str, vecs: Iterable[np.ndarray], src: Optional[Iterable[int]] = None):
+        arr = np.asarray(vecs, dtype=np.float32).reshape(-1, self.dim)
+        if not len(arr):
+            return
+        p = self._pid_of.get(name)
+        if p is None:
+            p = len(self.names)
+            self._pid_of[name] = p
+            self.names.append(name)
+        self._reserve(len(arr))
+        s, e = self.n, self.n + len(arr)
+        self.vecs[s:e] = quantize(arr, self.dtype, self.scale)
+        self.sqnorm[s:e] = self._norms(s, e)
+        self.pid[s:e] = p
+        self.src[s:e] = -1 if src is None else np.asarray(list(src), dtype=np.int64)
+        self.n = e
+        self._segments = None
+        if self.index is not None:
+            self.index.add(np.arange(s, e), self._rows_f32(slice(s, e)))
+
+    def remove(self, name: str) -> int:
+        # hapus semua baris satu orang; pid orang sesudahnya digeser turun
+        p = self._pid_of.get(name)
+        if p is None:
+            return 0
+        return self._drop(self.pid[:self.n] != p)
+
+    def _drop(self, keep: np.ndarray) -> int:
+        # padatkan baris yang keep di tempat; orang yang tidak tersisa
+        # barisnya ikut dihapus dan pid sesudahnya digeser turun
+        pid = self.pid[:self.n]
+        removed = int(self.n - keep.sum())
+        m = int(keep.sum())
+        self.vecs[:m] = self.vecs[:self.n][keep]
+        self.sqnorm[:m] = self.sqnorm[:self.n][keep]
+        self.src[:m] = self.src[:self.n][keep]
+        newpid = pid[keep]
+        left = np.bincount(newpid, minlength=len(self.names)) > 0
+        if not left.all():
+            newpid = (np.cumsum(left) - 1)[newpid].astype(np.int32)
+            self.names = [nm for nm, k in zip(self.names, left) if k]
+            self._pid_of = {nm: i for i, nm in enumerate(self.names)}
+        self.pid[:m] = newpid
+        if self.index is not None:
+            remap = np.cumsum(keep) - 1
+            remap[~keep] = -1
+            self.index.remap(remap)
+        self.n = m
+        self._segments = None
+        return removed
+
+    def build_index(self, nlist: int = 0, nprobe: int = 8, seed: int = 0):
+        # nlist 0 -> ~4*sqrt(N), umum dipakai untuk IVF
+        if self.n == 0:
+            self.index = None
+            return
+        nlist = nlist or int(4 * np.sqrt(self.n))
+        x = self._rows_f32(slice(0, self.n))
+        self.index = IVFIndex.train(x, nlist, nprobe, seed=seed)
+        self.index.add(np.arange(self.n), x)
+
+    # ---------- Snapshot (copy-on-write) ----------
+    # Galeri yang sudah dipublikasikan ke verify tidak diubah di tempat:
+    # writer membuat salinan, mengubahnya, lalu menukar referensinya. Append
+    # boleh berbagi buffer dengan snapshot lama karena snapshot lama hanya
+    # membaca baris [0, n) miliknya. Syarat: writer selalu berangkat dari
+    # snapshot terbaru dan berjalan satu per satu (lihat _write_lock di main.py).
+    def _clone(self, copy_rows: bool = False) -> "Gallery":
+        g = object.__new__(Gallery)
+        g.__dict__.update(self.__dict__)
+        g.names = list(self.names)
+        g._pid_of = dict(self._pid_of)
+        g._segments = None
+        g.index = self.index.copy() if self.index is not None else None
+        if copy_rows:
+            for attr in ("vecs", "sqnorm", "pid", "src"):
+                setattr(g, attr, getattr(self, attr)[:max(self.n, 1)].copy())
+        return g
+
+    def with_added(self, name: str, vecs: Iterable[np.ndarray], src: Optional[Iterable[int]] = None) -> "Gallery":
+        g = self._clone()
+        g.add(name, vecs, src=src)
+        return g
+
+    def with_rows(self, names: List[str], vecs: np.ndarray, src: Optional[np.ndarray] = None) -> "Gallery":
+        # with_added untuk beberapa baris (nama boleh berbeda) dengan satu salinan
+        g = self._clone()
+        for i, name in enumerate(names):
+            g.add(name, vecs[i:i + 1], src=None if src is None else src[i:i + 1])
+        return g
+
+    def without(self, name: str) -> Tuple["Gallery", int]:
+        # remove() memadatkan baris di tempat, jadi buffer disalin dulu
+        if name not in self._pid_of:
+            return self, 0
+        if self.mapped:
+            # memmap tidak diubah: baris orang ini cukup ditandai mati (pid -1)
+            g = self._clone()
+            p = g._pid_of.pop(name)
+            g.names[p] = None
+            g.pid = self.pid[:self.n].copy()
+            dead = g.pid == p
+            g.pid[dead] = -1
+            return g, int(dead.sum())
+        g = self._clone(copy_rows=True)
+        return g, g.remove(name)
+
+    def without_rows(self, src: Iterable[int]) -> Tuple["Gallery", int]:
+        # buang baris tertentu (nomor baris store), mis. vektor lama key yang diganti
+        dead = np.isin(self.src[:self.n], np.asarray(list(src), dtype=np.int64)) & (self.pid[:self.n] >= 0)
+        if not dead.any():
+            return self, 0
+        if self.mapped:
+            g = self._clone()
+            g.pid = self.pid[:self.n].copy()
+            gone = np.unique(g.pid[dead])
+            g.pid[dead] = -1
+            for p in gone[~np.isin(gone, g.pid)]:
+                del g._pid_of[g.names[p]]
+                g.names[p] = None
+            return g, int(dead.sum())
+        g = self._clone(copy_rows=True)
+        return g, g._drop(~dead)
+
+    def _segs(self):
+        # Baris dikelompokkan per orang (argsort stabil atas pid) supaya
+        # min per orang bisa diambil dengan satu np.minimum.reduceat.
+        if self._segments is None:
+            pid = self.pid[:self.n]
+            order = np.argsort(pid, kind="stable")
+            sp = pid[order]
+            k = int(np.searchsorted(sp, 0))  # pid -1 = baris mati (galeri mapped)
+            order, sp = order[k:], sp[k:]
+            starts = np.flatnonzero(np.r_[True, sp[1:] != sp[:-1]])
+            ends = np.r_[starts[1:], len(sp)]
+            self._segments = (order, starts, ends, sp[starts])
+        return self._segments
+
+    def _person_rows(self, rows: np.ndarray, use_source: bool) -> np.ndarray:
+        if use_source and self.fetch_exact is not None:
+            src = self.src[rows]
+            if (src >= 0).all():
+                return np.asarray(self.fetch_exact(src), dtype=np.float64)
+        return self._rows_f32(rows).astype(np.float64)
+
+    def _rerank(self, c: np.ndarray, pids: Iterable[int], use_source: bool = False) -> List[Tuple[float, int]]:
+        # jarak Euclidean float64 atas SEMUA baris orang kandidat, sama seperti loop lama
+        order, starts, ends, seg_pid = self._segs()
+        exact = []
+        for p in pids:
+            s = int(np.searchsorted(seg_pid, p))
+            rows = self._person_rows(order[starts[s]:ends[s]], use_source)
+            exact.append((float(np.min(np.linalg.norm(rows - c, axis=1))), int(p)))
+        exact.sort()  # seri: pid lebih kecil (urutan load) menang, sama seperti loop lama
+        return exact
+
+    def rank(self, cand: np.ndarray, exact: bool = False,
+             recheck: Optional[Callable[[float, float], bool]] = None) -> List[Tuple[float, str]]:
+        # -> [(jarak, nama)] terurut untuk beberapa orang teratas.
+        # Ranking kasar float32 untuk semua baris sekaligus, lalu jarak
+        # Euclidean float64 dihitung ulang untuk orang-orang teratas.
+        # Galeri compact: kalau recheck(best, second) True (dekat batas
+        # TOLERANCE/MARGIN_GAP), orang teratas dihitung ulang dari float32 asli.
+        if not self._pid_of:
+            return []
+        c = np.asarray(cand, dtype=np.float64).ravel()
+        if self.index is not None and not exact:
+            pids = self._ann_candidates(c)
+            if pids is None:
+                pids = self._exact_candidates(c)
+        else:
+            pids = self._exact_candidates(c)
+        return self._finish(c, pids, recheck)
+
+    def rank_batch(self, cands: np.ndarray, exact: bool = False,
+                   recheck: Optional[Callable[[float, float], bool]] = None) -> List[List[Tuple[float, str]]]:
+        # rank() untuk B probe sekaligus: ranking kasar satu GEMM (N, DIM) x (DIM, B),
+        # rerank exact tetap per probe. Dengan index ANN tiap probe dicari sendiri.
+        C = np.asarray(cands, dtype=np.float64).reshape(-1, self.dim)
+        if not self._pid_of:
+            return [[] for _ in C]
+        if self.index is not None and not exact:
+            return [self.rank(c, recheck=recheck) for c in C]
+        d2 = self.sqnorm[:self.n, None] - 2.0 * self._dots(np.ascontiguousarray(C.T, dtype=np.float32))
+        order, starts, ends, seg_pid = self._segs()
+        pmin = np.minimum.reduceat(d2[order], starts, axis=0)  # (orang, B)
+        k = min(_RECHECK_TOP, len(pmin))
+        if len(pmin) > k:
+            top = np.argpartition(pmin, k - 1, axis=0)[:k]
+        else:
+            top = np.repeat(np.arange(len(pmin))[:, None], len(C), axis=1)
+        return [self._finish(c, seg_pid[top[:, j]], recheck) for j, c in enumerate(C)]
+
+    def _finish(self, c: np.ndarray, pids: np.ndarray,
+                recheck: Optional[Callable[[float, float], bool]]) -> List[Tuple[float, str]]:
+        res = self._rerank(c, pids)
+        if self.compact and recheck is not None:
+            best, second = res[0][0], (res[1][0] if len(res) > 1 else 1e9)
+            if recheck(best, second):
+                res = self._rerank(c, pids, use_source=True)
+        return [(d, self.names[p]) for d, p in res]
+
+    def match(self, cand: np.ndarray, exact: bool = False,
+              recheck: Optional[Callable[[float, float], bool]] = None) -> Tuple[str, float, float]:
+        # (nama, best, second) identik dengan loop lama per orang (mode float32)
+        return best_second(self.rank(cand, exact=exact, recheck=recheck))
+
+    def _exact_candidates(self, c: np.ndarray) -> np.ndarray:
+        d2 = self.sqnorm[:self.n] - 2.0 * self._dots(c.astype(np.float32))
+        order, starts, ends, seg_pid = self._segs()
+        pmin = np.minimum.reduceat(d2[order], starts)
+        k = min(_RECHECK_TOP, len(pmin))
+        top = np.argpartition(pmin, k - 1)[:k] if len(pmin) > k else np.arange(len(pmin))
+        return seg_pid[top]
+
+    def _ann_candidates(self, c: np.ndarray) -> Optional[np.ndarray]:
+        # Kandidat dari nprobe inverted list terdekat, lalu orang-orang
+        # teratas di-rerank exact atas semua barisnya. Orang yang tidak
+        # masuk kandidat bisa terlewat (approximate), nilai best/second
+        # yang dilaporkan tetap jarak exact. Kurang dari 2 orang -> None
+        # (exact), supaya second dan MARGIN_GAP tetap bermakna.
+        rows = self.index.search(c.astype(np.float32))
+        rows = rows[self.pid[rows] >= 0]
+        if not len(rows):
+            return None
+        d2 = self.sqnorm[rows] - 2.0 * (self._rows_f32(rows) @ c.astype(np.float32))
+        p = self.pid[rows]
+        o = np.lexsort((d2, p))
+        ps = p[o]
+        first = np.flatnonzero(np.r_[True, ps[1:] != ps[:-1]])
+        pmin, pids = d2[o][first], ps[first]
+        if len(pids) < 2:
+            return None
+        k = min(_RECHECK_TOP, len(pmin))
+        top = np.argpartition(pmin, k - 1)[:k] if len(pmin) > k else np.arange(len(pmin))
+        return pids[top]
+
+
+def best_second(ranked: List[Tuple[float, str]]) -> Tuple[str, float, float]:
+    if not ranked:
+        return "", 1e9, 1e9
+    return ranked[0][1], ranked[0][0], (ranked[1][0] if len(ranked) > 1 else 1e9)
+
+
+def merge_ranked(lists: Iterable[List[Tuple[float, str]]]) -> List[Tuple[float, str]]:
+    # gabung ranking beberapa partisi; nama yang sama dihitung sekali (jarak terkecil).
+    # top-2 global selalu ada di top-2 salah satu partisi, jadi ini exact.
+    best: Dict[str, float] = {}
+    for ranked in lists:
+        for d, name in ranked:
+            if name not in best or d < best[name]:
+                best[name] = d
+    return sorted((d, name) for name, d in best.items())
+
+
+# ---------- ANN: IVF (k-means coarse quantizer + inverted lists) ----------
+def _nearest_centroid(x: np.ndarray, cents: np.ndarray, chunk: int = 16384) -> np.ndarray:
+    cn = np.einsum("ij,ij->i", cents, cents)
+    out = np.empty(len(x), dtype=np.int32)
+    for s in range(0, len(x), chunk):
+        out[s:s + chunk] = np.argmin(cn - 2.0 * (x[s:s + chunk] @ cents.T), axis=1)
+    return out
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    k = max(1, min(k, len(x)))
+    cents = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        a = _nearest_centroid(x, cents)
+        o = np.argsort(a, kind="stable")
+        sa = a[o]
+        starts = np.flatnonzero(np.r_[True, sa[1:] != sa[:-1]])
+        counts = np.diff(np.r_[starts, len(sa)])
+        cents[sa[starts]] = np.add.reduceat(x[o], starts, axis=0) / counts[:, None]
+        empty = np.setdiff1d(np.arange(k), sa[starts])
+        if len(empty):  # cluster kosong -> ambil titik acak baru
+            cents[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+    return cents
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, nprobe: int = 8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nprobe = nprobe
+        self._cn = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        self.lists: List[np.ndarray] = [np.empty(0, dtype=np.int64) for _ in range(len(self.centroids))]
+
+    @classmethod
+    def train(cls, vecs: np.ndarray, nlist: int, nprobe: int = 8, seed: int = 0,
+              max_train: int = 65536) -> "IVFIndex":
+        rng = np.random.default_rng(seed)
+        sample = vecs if len(vecs) <= max_train else vecs[rng.choice(len(vecs), max_train, replace=False)]
+        return cls(kmeans(sample, nlist, seed=seed), nprobe)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def copy(self) -> "IVFIndex":
+        # add/remap mengganti array list, tidak mengubahnya -> salinan dangkal cukup
+        ix = IVFIndex.__new__(IVFIndex)
+        ix.__dict__.update(self.__dict__)
+        ix.lists = list(self.lists)
+        return ix
+
+    def add(self, rows: np.ndarray, vecs: np.ndarray):
+        a = _nearest_centroid(np.asarray(vecs, dtype=np.float32), self.centroids)
+        for li in np.unique(a):
+            self.lists[li] = np.concatenate([self.lists[li], rows[a == li]])
+
+    def remap(self, remap: np.ndarray):
+        # remap[row_lama] = row_baru, -1 = dihapus
+        for li, r in enumerate(self.lists):
+            if len(r):
+                nr = remap[r]
+                self.lists[li] = nr[nr >= 0]
+
+    def search(self, c: np.ndarray, nprobe: int = 0) -> np.ndarray:
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        d = self._cn - 2.0 * (self.centroids @ c)
+        probe = np.argpartition(d, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        return np.concatenate([self.lists[li] for li in probe])
@@ -1,13 +1,21 @@
 # main.py — Vector Store + auto-migrate from faces + reload-from-faces
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import face_recognition as fr
 from PIL import Image, ImageOps, ImageFile
 import numpy as np
-from pathlib import Path
-import io, os, time, re
-from typing import Dict, List, Tuple
+from pathlib import Path, PurePosixPath
+import io, os, time, re, asyncio, hashlib, json, threading, base64, binascii
+import queue, shutil, tarfile, tempfile, zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel
+from gallery import Gallery, int8_scale, best_second, merge_ranked
+import metrics
+from store import PackedStore, PACKED_DIRNAME, iter_legacy, read_legacy, convert_legacy
 
 try:
     from pillow_heif import register_heif_opener
@@ -15,6 +23,12 @@ try:
 except Exception:
     pass
 
+# dlib langsung (ikut terpasang bersama face_recognition) untuk encode batch.
+try:
+    import dlib
+except Exception:
+    dlib = None
+
 # Optional fallback for wider image format support.
 try:
     import imageio.v3 as iio
@@ -35,7 +49,7 @@ ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 # ===== Paths (absolute) =====
 BASE_DIR = Path(__file__).resolve().parent
-EMB_DIR  = BASE_DIR / "embeddings"      # tempat vektor .npy
+EMB_DIR  = BASE_DIR / "embeddings"      # tempat vektor (packed di _packed/, lama: <nama>/*.npy)
 FACES_DIR = BASE_DIR / "faces"          # opsional (kalau mau drop foto manual)
 EMB_DIR.mkdir(parents=True, exist_ok=True)
 FACES_DIR.mkdir(parents=True, exist_ok=True)
@@ -47,15 +61,90 @@ UPSAMPLE    = int(os.getenv("FACE_UPSAMPLE",    "0"))      # 0 cepat, 1 lebih te
 MODEL       = os.getenv("FACE_MODEL", "hog")               # "hog" CPU; "cnn" kalau ada CUDA
 ENC_JITTERS = int(os.getenv("FACE_JITTERS",     "2"))      # jitter buat robust
 MAX_WIDTH   = int(os.getenv("FACE_MAX_WIDTH",   "800"))    # resize foto masuk untuk speed
+DETECT_WIDTH = int(os.getenv("FACE_DETECT_WIDTH", "0"))   # >0: deteksi HOG di proxy selebar ini (320–480), encode dari crop resolusi penuh
+ENCODE_MAX_WIDTH = int(os.getenv("FACE_ENCODE_MAX_WIDTH", "1600"))  # two-stage: lebar maksimum gambar sumber crop; 0 = asli
+CROP_MARGIN = float(os.getenv("FACE_CROP_MARGIN", "0.5"))  # two-stage: margin crop relatif ukuran box
+MAX_PIXELS  = int(os.getenv("FACE_MAX_PIXELS",  "40000000"))  # batas piksel hasil decode (proteksi RAM)
 AUTO_MIGRATE_FACES = os.getenv("AUTO_MIGRATE_FACES", "0") == "1"  # auto-scan faces/ on startup
+EMB_FORMAT  = os.getenv("FACE_EMB_FORMAT", "packed")       # "packed" (mmap + manifest) | "npy" (layout lama)
+ENC_WORKERS = int(os.getenv("FACE_WORKERS",     str(os.cpu_count() or 1)))  # proses encoder; 0 = thread di proses ini
+ENC_QUEUE   = int(os.getenv("FACE_QUEUE_MAX",   "8"))      # antrean tunggu di luar yang sedang diproses; lebih -> 503
+GALLERY_DTYPE = os.getenv("FACE_GALLERY_DTYPE", "float32")  # "float32" | "float16" | "int8" (compact, hemat RAM)
+RECHECK_EPS = float(os.getenv("FACE_RECHECK_EPS", "0.02"))  # compact: cek ulang float32 kalau sedekat ini ke batas; 0 = mati
+ANN         = os.getenv("FACE_ANN", "0") == "1"           # IVF index (approximate) untuk galeri besar
+ANN_NLIST   = int(os.getenv("FACE_ANN_NLIST",   "0"))      # jumlah cluster; 0 = otomatis ~4*sqrt(N)
+ANN_NPROBE  = int(os.getenv("FACE_ANN_NPROBE",  "8"))      # cluster yang diperiksa per query; makin besar makin akurat
+ANN_MIN_ROWS = int(os.getenv("FACE_ANN_MIN_ROWS", "20000"))  # di bawah ini tetap exact
+MIGRATE_WORKERS = int(os.getenv("FACE_MIGRATE_WORKERS", str(os.cpu_count() or 1)))  # proses untuk job migrasi faces/
+MAX_LOADED_GROUPS = int(os.getenv("FACE_MAX_LOADED_GROUPS", "0"))  # 0 = tanpa batas; lebih -> group LRU dilepas dari RAM
+SHARED_MMAP = os.getenv("FACE_SHARED_MMAP", "0") == "1"  # packed: matrix galeri = memmap store, dibagi antar worker uvicorn
+if SHARED_MMAP and os.name == "nt":
+    # Windows tidak mengizinkan truncate/replace file yang masih punya view mmap
+    # terbuka (crash recovery di append, compact) -> galeri tetap salinan per proses
+    print("[CONFIG][WARN] FACE_SHARED_MMAP is not supported on Windows, ignored")
+    SHARED_MMAP = False
+WARMUP      = os.getenv("FACE_WARMUP", "1") == "1"         # inferensi dummy saat startup sebelum melayani request
+BATCH_WINDOW_MS = float(os.getenv("FACE_BATCH_WINDOW_MS", "0"))  # >0: verify yang datang dalam jendela ini diproses satu batch
+BATCH_MAX   = int(os.getenv("FACE_BATCH_MAX",   "16"))     # ukuran batch maksimum; penuh -> langsung diproses
+EMB_BATCH_MAX = int(os.getenv("FACE_EMB_BATCH_MAX", "256"))  # /verify-embedding: vektor maksimum per request
+BULK_MAX_FILE_MB = float(os.getenv("FACE_BULK_MAX_FILE_MB", "20"))  # /enroll-bulk: foto lebih besar dilewati
+
+# ===== In-memory store: satu Gallery per group (site/departemen/kelas) =====
+# Group default ("") = layout lama di embeddings/ dan selalu dimuat. Group
+# bernama ada di embeddings/_groups/<group>/, dimuat saat pertama dipakai
+# dan dilepas (LRU) kalau lebih dari MAX_LOADED_GROUPS.
+# Setiap Gallery di _galleries adalah snapshot yang tidak diubah lagi: writer
+# (enroll/delete/migrasi/reload) membuat versi baru di samping lalu menukar
+# referensinya, jadi verify membaca tanpa lock dan tidak pernah melihat galeri
+# kosong atau setengah jadi.
+DEFAULT_GROUP = ""
+GROUPS_DIR = EMB_DIR / "_groups"
+_galleries: "OrderedDict[str, Gallery]" = OrderedDict()
+_stores: Dict[str, PackedStore] = {}
+_versions: Dict[str, int] = {}     # naik setiap ada tulis ke group (dicek reload sebelum swap)
+# packed: ((generation, epoch), offset manifest, jumlah baris) yang sudah ada di
+# snapshot. Worker lain (uvicorn --workers N) menulis ke store yang sama; kalau
+# generation di store berubah, baris baru dibaca dari ekor manifest (_catch_up).
+_sync: Dict[str, Tuple[Tuple[int, int], int, int]] = {}
+_write_lock = threading.RLock()    # writer satu per satu; verify tidak memakai lock ini, build tidak menahannya
+_load_lock = threading.Lock()      # load pertama group (lazy) satu per satu
+
+# ---------- Metrics ----------
+M_STAGE   = metrics.Histogram("face_stage_seconds", "Durasi per stage (decode, resize, detect, encode, match, ...)", ["stage"])
+M_REQUEST = metrics.Histogram("face_request_seconds", "Durasi total request", ["endpoint"])
+M_VERIFY  = metrics.Counter("face_verify_total", "Hasil verify per outcome", ["outcome"])
+M_ENROLL  = metrics.Counter("face_enroll_total", "Hasil enroll per outcome", ["outcome"])
+M_RELOAD  = metrics.Histogram("face_gallery_reload_seconds", "Durasi load_embeddings", buckets=(
+    0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+metrics.Gauge("face_gallery_persons", "Jumlah orang di galeri (semua group yang dimuat)",
+              lambda: sum(g.num_persons for g in list(_galleries.values())))
+metrics.Gauge("face_gallery_vectors", "Jumlah vektor di galeri (semua group yang dimuat)",
+              lambda: sum(len(g) for g in list(_galleries.values())))
+metrics.Gauge("face_gallery_groups_loaded", "Jumlah group yang ada di RAM", lambda: len(_galleries))
+metrics.Gauge("face_encoder_inflight", "Request encode yang sedang jalan/antre", lambda: _inflight)
+M_BATCH_SIZE = metrics.Histogram("face_verify_batch_size", "Jumlah request verify per micro-batch", buckets=(
+    1, 2, 4, 8, 16, 32, 64))
+M_BATCH_WAIT = metrics.Histogram("face_verify_batch_wait_seconds", "Waktu tunggu request sampai batch-nya diproses", buckets=(
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
 
-# ===== In-memory store: name -> list[np.ndarray] =====
-emb_by_person: Dict[str, List[np.ndarray]] = {}
+def _lap(timings: Optional[Dict[str, float]], stage: str, t0: float) -> float:
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (now - t0)
+    return now
+
+def _observe(timings: Dict[str, float]):
+    for stage, dt in timings.items():
+        M_STAGE.observe(dt, stage)
 
 # ---------- Utilities ----------
-def _slug(s: str) -> str:
+def _name_key(s: str) -> str:
+    # nama folder/key yang aman; "" kalau tidak ada karakter yang tersisa
     s = re.sub(r'[^a-z0-9\-_. ]+', '', s.strip().lower())
-    return re.sub(r'\s+', '_', s) or f"user_{int(time.time())}"
+    return re.sub(r'\s+', '_', s)
+
+def _slug(s: str) -> str:
+    return _name_key(s) or f"user_{int(time.time())}"
 
 def _resize_np(img_np: np.ndarray, max_w: int) -> Tuple[np.ndarray, float]:
     h, w = img_np.shape[:2]
@@ -81,16 +170,38 @@ def _normalize_uint8(img: np.ndarray) -> np.ndarray:
         img = img * (255.0 / maxv)
     return np.clip(img, 0, 255).astype(np.uint8)
 
-def _to_rgb_uint8(raw: bytes) -> np.ndarray:
+_ROTATED = (5, 6, 7, 8)  # EXIF orientation yang menukar lebar/tinggi
+
+class ImageTooLarge(ValueError):
+    pass
+
+def _check_pixels(w: int, h: int):
+    if w * h > MAX_PIXELS:
+        raise ImageTooLarge(f"Image too large: {w}x{h} > {MAX_PIXELS} pixels")
+
+def _to_rgb_uint8(raw: bytes, min_width: int = 0) -> np.ndarray:
     try:
         pil = Image.open(io.BytesIO(raw))
+        if min_width:
+            # JPEG: minta decoder langsung di skala 1/2, 1/4 atau 1/8 (draft mode),
+            # lebar setelah exif_transpose tetap >= min_width jadi resize akhir
+            # tidak pernah upscale. Format lain: no-op, decode penuh seperti biasa.
+            rotated = pil.getexif().get(0x0112, 1) in _ROTATED
+            pil.draft("RGB", (1, min_width) if rotated else (min_width, 1))
+        _check_pixels(*pil.size)
         pil = ImageOps.exif_transpose(pil)
         if pil.mode != "RGB":
             pil = pil.convert("RGB")
         img = np.asarray(pil)
+    except ImageTooLarge:
+        raise
     except Exception:
         if not _HAS_IMAGEIO:
             raise
+        # ukuran dari metadata dulu, baru decode (batas piksel juga berlaku di sini)
+        props = iio.improps(raw)
+        shape = props.shape[1:] if props.is_batch else props.shape
+        _check_pixels(shape[1], shape[0])
         img = iio.imread(raw)
 
     if img.ndim == 2:
@@ -101,132 +212,863 @@ def _to_rgb_uint8(raw: bytes) -> np.ndarray:
     img = _normalize_uint8(img)
     return np.ascontiguousarray(img, dtype=np.uint8)
 
-def _encode_image_bytes(raw: bytes, jitters: int = 1):
-    img = _to_rgb_uint8(raw)
-    img, _ = _resize_np(img, MAX_WIDTH)
+def _crop_face(img: np.ndarray, loc, scale: float):
+    # box dari proxy (skala `scale`) -> koordinat gambar besar, lalu crop + margin
+    h, w = img.shape[:2]
+    top, right, bottom, left = (int(round(v / scale)) for v in loc)
+    top, left = max(top, 0), max(left, 0)
+    bottom, right = min(bottom, h), min(right, w)
+    m = int(CROP_MARGIN * max(bottom - top, right - left))
+    y0, y1 = max(top - m, 0), min(bottom + m, h)
+    x0, x1 = max(left - m, 0), min(right + m, w)
+    crop = np.ascontiguousarray(img[y0:y1, x0:x1])
+    return crop, (top - y0, right - x0, bottom - y0, left - x0)
+
+def _locate_face(raw: bytes, timings: Optional[Dict[str, float]] = None):
+    # -> (img, box): gambar yang akan di-encode + lokasi wajah pertama
+    # (top, right, bottom, left) di gambar itu; box None = tidak ada wajah.
+    # Two-stage (DETECT_WIDTH > 0): HOG di proxy kecil, landmark + encoding
+    # di crop dari gambar resolusi ENCODE_MAX_WIDTH.
+    two_stage = DETECT_WIDTH > 0
+    t = time.perf_counter()
+    img = _to_rgb_uint8(raw, min_width=ENCODE_MAX_WIDTH if two_stage else MAX_WIDTH)
+    t = _lap(timings, "decode", t)
+    if two_stage:
+        if ENCODE_MAX_WIDTH:
+            img, _ = _resize_np(img, ENCODE_MAX_WIDTH)
+        det, scale = _resize_np(img, DETECT_WIDTH)
+    else:
+        img, _ = _resize_np(img, MAX_WIDTH)
+        det, scale = img, 1.0
     img = np.ascontiguousarray(img, dtype=np.uint8)
+    det = np.ascontiguousarray(det, dtype=np.uint8)
+    t = _lap(timings, "resize", t)
     try:
-        locs = fr.face_locations(img, model=MODEL, number_of_times_to_upsample=UPSAMPLE)
+        locs = fr.face_locations(det, model=MODEL, number_of_times_to_upsample=UPSAMPLE)
     except RuntimeError as e:
-        print(f"[ENCODE][ERROR] {e} dtype={img.dtype} shape={img.shape}")
+        print(f"[ENCODE][ERROR] {e} dtype={det.dtype} shape={det.shape}")
         raise
+    t = _lap(timings, "detect", t)
     if not locs:
+        return img, None
+    if scale == 1.0:
+        return img, locs[0]
+    img, box = _crop_face(img, locs[0], scale)
+    _lap(timings, "crop", t)
+    return img, box
+
+def _encode_image_bytes(raw: bytes, jitters: int = 1, timings: Optional[Dict[str, float]] = None):
+    img, box = _locate_face(raw, timings)
+    if box is None:
         return None
-    encs = fr.face_encodings(img, known_face_locations=[locs[0]], num_jitters=jitters)
+    t = time.perf_counter()
+    encs = fr.face_encodings(img, known_face_locations=[box], num_jitters=jitters)
+    _lap(timings, "encode", t)
     return encs[0] if encs else None
 
+def _encode_timed(raw: bytes, jitters: int = 1):
+    # versi untuk worker pool: timing ikut dikembalikan ke proses utama
+    timings: Dict[str, float] = {}
+    return _encode_image_bytes(raw, jitters, timings), timings
+
+def _warm() -> float:
+    # inferensi dummy (deteksi + landmark + encoder) supaya model dlib dan
+    # alokasinya siap sebelum request pertama; dipanggil di tiap proses
+    t = time.perf_counter()
+    img = np.zeros((150, 150, 3), dtype=np.uint8)
+    fr.face_locations(img, model=MODEL, number_of_times_to_upsample=UPSAMPLE)
+    fr.face_encodings(img, known_face_locations=[(0, 150, 150, 0)], num_jitters=1)
+    return time.perf_counter() - t
+
+def _align_face(raw: bytes, jitters: int = 1):
+    # micro-batching, job per request di worker pool: decode + deteksi + align
+    # (chip 150x150, sama seperti compute_face_descriptor biasa). Encode-nya
+    # dikumpulkan per batch (_encode_chips). -> (chip, enc, timings); tanpa
+    # dlib langsung di-encode di sini (chip None); keduanya None = tidak ada wajah.
+    timings: Dict[str, float] = {}
+    img, box = _locate_face(raw, timings)
+    if box is None:
+        return None, None, timings
+    t = time.perf_counter()
+    if dlib is None:
+        encs = fr.face_encodings(img, known_face_locations=[box], num_jitters=jitters)
+        _lap(timings, "encode", t)
+        return None, (encs[0] if encs else None), timings
+    shape = fr.api.pose_predictor_5_point(img, fr.api._css_to_rect(box))
+    chip = dlib.get_face_chip(img, shape, size=150, padding=0.25)
+    _lap(timings, "align", t)
+    return chip, None, timings
+
+def _encode_chips(chips: List[np.ndarray], jitters: int = 1):
+    # job per batch: semua chip di-encode dengan satu panggilan dlib -> (encs, detik)
+    t = time.perf_counter()
+    descs = fr.api.face_encoder.compute_face_descriptor(chips, jitters)
+    return [np.array(d) for d in descs], time.perf_counter() - t
+
+# ---------- Encoder pool ----------
+# Decode + deteksi + encode itu CPU-bound; jalankan di process pool supaya
+# event loop (dan /health) tetap responsif. Worker mengimpor modul ini,
+# jadi semua efek samping berat ada di startup event, bukan di top-level.
+_pool: Optional[ProcessPoolExecutor] = None
+_inflight = 0  # job encode yang sedang jalan/antre: verify/enroll (event loop) + bulk enroll (thread)
+_inflight_lock = threading.Lock()
+
+class EncoderBusy(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=503, detail="Face encoder sedang sibuk, coba lagi sebentar.",
+                         headers={"Retry-After": "2"})
+
+def _start_pool():
+    # WARMUP: setiap worker (termasuk pengganti setelah crash) menjalankan
+    # _warm sebelum job pertamanya
+    global _pool
+    if ENC_WORKERS > 0:
+        _pool = ProcessPoolExecutor(max_workers=ENC_WORKERS, initializer=_warm if WARMUP else None)
+
+def _worker_pid(hold: float) -> int:
+    time.sleep(hold)  # tahan sebentar supaya ping tersebar ke worker lain
+    return os.getpid()
+
+def _warm_pool(timeout: float = 120.0) -> int:
+    # ping sampai semua worker (pid berbeda) menjawab; job baru jalan setelah
+    # initializer selesai, jadi pid yang menjawab = worker yang sudah warm
+    seen = set()
+    deadline = time.time() + timeout
+    while len(seen) < ENC_WORKERS and time.time() < deadline:
+        seen.update(_pool.map(_worker_pid, [0.05] * ENC_WORKERS))
+    return len(seen)
+
+async def _pool_call(fn, *args):
+    global _pool
+    pool = _pool
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # worker mati (mis. crash di dlib) -> semua job di pool itu gagal bersamaan;
+        # hanya yang pertama mengganti pool, sisanya cukup dapat 503. Tanpa
+        # cancel_futures: job yang antre sudah digagalkan pool dengan
+        # BrokenProcessPool, bukan CancelledError
+        if pool is not None and _pool is pool:
+            print("[POOL][ERROR] encoder pool broken, restarting")
+            _pool = None
+            pool.shutdown(wait=False)
+            _start_pool()
+        raise EncoderBusy()
+
+def _admit():
+    # kapasitas per request: decode + deteksi selalu satu job pool per request
+    global _inflight
+    with _inflight_lock:
+        if _inflight >= max(ENC_WORKERS, 1) + ENC_QUEUE:
+            raise EncoderBusy()
+        _inflight += 1
+
+def _hold():
+    # bulk enroll: selalu masuk (dibatasi sendiri di bawah jumlah worker), tetap dihitung
+    global _inflight
+    with _inflight_lock:
+        _inflight += 1
+
+def _release(n: int = 1):
+    global _inflight
+    with _inflight_lock:
+        _inflight -= n
+
+async def _encode_async(raw: bytes, jitters: int = 1, timings: Optional[Dict[str, float]] = None):
+    _admit()
+    try:
+        t0 = time.perf_counter()
+        enc, worker_t = await _pool_call(_encode_timed, raw, jitters)
+        if timings is not None:
+            timings.update(worker_t)
+            # sisa waktu = antre di pool + pickling bolak-balik
+            timings["queue"] = max(time.perf_counter() - t0 - sum(worker_t.values()), 0.0)
+        return enc
+    finally:
+        _release()
+
 # ---------- Load/Reload ----------
+class InvalidGroup(HTTPException):
+    def __init__(self, group: str):
+        super().__init__(status_code=400, detail=f"Group tidak valid: {group!r}")
+
+def _group_key(group: Optional[str]) -> str:
+    # nama group = nama folder di _groups/: tanpa fallback user_<ts> seperti _slug,
+    # dan ".", "..", ".x", "_x" ditolak (keluar dari _groups/ atau bentrok dengan _packed)
+    group = (group or "").strip()
+    if not group:
+        return DEFAULT_GROUP
+    key = _name_key(group)
+    if not key or key[0] in "._":
+        raise InvalidGroup(group)
+    return key
+
+def _emb_dir(group: str) -> Path:
+    return EMB_DIR if group == DEFAULT_GROUP else GROUPS_DIR / group
+
+def _store(group: str = DEFAULT_GROUP) -> PackedStore:
+    st = _stores.get(group)
+    if st is None:
+        st = _stores[group] = PackedStore(_emb_dir(group) / PACKED_DIRNAME, compact=GALLERY_DTYPE)
+    return st
+
+def _build_gallery(group: str) -> Tuple[Gallery, Optional[tuple]]:
+    # -> (gallery, sync state untuk _sync; None di layout npy)
+    t0 = time.perf_counter()
+    sync = None
+    if EMB_FORMAT == "packed":
+        st = _store(group)
+        if not st.exists():
+            # sekali saja: pindahkan <emb_dir>/<nama>/*.npy ke packed store
+            added = convert_legacy(_emb_dir(group), st)
+            print(f"[CONVERT] legacy .npy -> packed store ({group or 'default'}): {added} vectors")
+        gen = st.generation()  # dibaca SEBELUM manifest: tulisan sesudahnya pasti ketahuan
+        if SHARED_MMAP:
+            names, alive, mm, pos = st.load_mapped()
+            g = Gallery.from_mapped(names, alive, mm, dtype=GALLERY_DTYPE, scale=st.scale)
+        else:
+            names, _, vecs, rows, pos = st.load()
+            g = Gallery.from_rows(names, vecs, dtype=GALLERY_DTYPE, scale=st.scale, src=rows)
+        g.fetch_exact = st.read_rows  # re-check float32 dari vectors.f32 (mmap)
+        sync = (gen,) + pos
+    else:
+        names, _, vecs = read_legacy(_emb_dir(group))
+        scale = int8_scale(vecs) if GALLERY_DTYPE == "int8" else None
+        g = Gallery.from_rows(names, vecs, dtype=GALLERY_DTYPE, scale=scale)
+    if ANN and len(g) >= ANN_MIN_ROWS:
+        g.build_index(nlist=ANN_NLIST, nprobe=ANN_NPROBE)
+        print(f"[ANN] IVF index ({group or 'default'}) nlist={g.index.nlist} nprobe={g.index.nprobe}")
+    M_RELOAD.observe(time.perf_counter() - t0)
+    print(f"[SUMMARY] group={group or 'default'} persons={g.num_persons} vectors={len(g)}")
+    return g, sync
+
+def _gallery(group: str = DEFAULT_GROUP) -> Gallery:
+    # snapshot aktif, dibaca tanpa lock; group belum dimuat -> load (lazy)
+    g = _galleries.get(group)
+    if g is not None:
+        try:
+            _galleries.move_to_end(group)
+        except KeyError:
+            pass  # baru saja di-evict; snapshot yang sudah dipegang tetap valid
+        sync = _sync.get(group)
+        if sync is not None and _store(group).generation() != sync[0]:
+            g = _catch_up(group, g)  # ada tulisan baru (worker ini atau worker lain)
+        return g
+    if group != DEFAULT_GROUP and not _emb_dir(group).exists():
+        return Gallery(capacity=1)  # group tidak dikenal: kosong, tidak di-cache
+    with _load_lock:
+        g = _galleries.get(group)
+        if g is None:
+            g = _reload_group(group)
+            with _write_lock:
+                _evict_groups()
+    return g
+
+def _publish(group: str, g: Gallery, sync: Optional[tuple] = None):
+    # panggil dengan _write_lock dipegang; satu assignment = swap atomik
+    _galleries[group] = g
+    if sync is not None:
+        _sync[group] = sync
+    _versions[group] = _versions.get(group, 0) + 1
+
+def _update(group: str, fn):
+    # writer inkremental: fn(snapshot lama) -> snapshot baru. Group yang belum
+    # dimuat cukup dicatat; isinya dibaca dari disk saat pertama dipakai.
+    # Packed: perubahan dibaca dari manifest (_advance), sama seperti tulisan
+    # worker lain, jadi fn hanya dipakai di layout npy.
+    g = _galleries.get(group)
+    if g is None:
+        _versions[group] = _versions.get(group, 0) + 1
+        return
+    sync = _sync.get(group)
+    if sync is None:
+        _publish(group, fn(g))
+        return
+    nxt = _advance(group, g, sync)
+    if nxt is not None and nxt[1] != sync:
+        _publish(group, *nxt)
+    # None: compact di proses lain -> _gallery() build ulang, di luar _write_lock
+
+def _catch_up(group: str, g: Gallery) -> Gallery:
+    # snapshot terbaru: ekor manifest (kecil) diterapkan di bawah _write_lock,
+    # compact di proses lain -> build ulang penuh di luar lock
+    with _write_lock:
+        cur, sync = _galleries.get(group), _sync.get(group)
+        if cur is None or sync is None:
+            return g  # baru saja di-evict
+        nxt = _advance(group, cur, sync)
+        if nxt is not None:
+            if nxt[1] != sync:
+                _publish(group, *nxt)
+            return nxt[0]
+    return _reload_group(group)  # compact: build ulang tanpa menahan writer
+
+def _advance(group: str, g: Gallery, sync: tuple) -> Optional[Tuple[Gallery, tuple]]:
+    # panggil dengan _write_lock dipegang. Terapkan ekor manifest sejak sync:
+    # "+" -> tambah baris, "-" -> buang orang itu, "~" -> buang satu baris.
+    # -> (snapshot, sync) terbaru; None = epoch berubah (compact), nomor
+    # baris lain, harus build ulang.
+    st = _store(group)
+    gen = st.generation()
+    if gen == sync[0]:
+        return g, sync
+    if gen[1] != sync[0][1]:
+        return None
+    ops, offset = st.tail(sync[1])
+    nrows, adds = sync[2], []
+    for op, name, arg in ops:
+        if op == "+":
+            adds.append(name)
+            continue
+        g, nrows = _apply_rows(g, st, adds, nrows)
+        adds = []
+        g = g.without(name)[0] if op == "-" else g.without_rows([int(arg)])[0]
+    g, nrows = _apply_rows(g, st, adds, nrows)
+    return g, (gen, offset, nrows)
+
+def _apply_rows(g: Gallery, st: PackedStore, names: List[str], n0: int) -> Tuple[Gallery, int]:
+    # baris store [n0, n0+len(names)) -> snapshot baru
+    if not names:
+        return g, n0
+    n1 = n0 + len(names)
+    if g.mapped:
+        return g.extend_mapped(st.map_rows(n1), names), n1
+    rows = np.arange(n0, n1)
+    return g.with_rows(names, st.read_rows(rows), src=rows), n1
+
+def _evict_groups():
+    if MAX_LOADED_GROUPS <= 0:
+        return
+    while len(_galleries) > MAX_LOADED_GROUPS:
+        victim = next((k for k in _galleries if k != DEFAULT_GROUP), None)
+        if victim is None:
+            return
+        del _galleries[victim]
+        print(f"[GROUP] evicted {victim} from memory")
+
+def _groups_on_disk() -> List[str]:
+    if not GROUPS_DIR.exists():
+        return []
+    return sorted(p.name for p in GROUPS_DIR.iterdir() if p.is_dir())
+
+def _reload_group(group: str, attempts: int = 3) -> Gallery:
+    # build di samping tanpa menahan _write_lock (enroll/delete tetap jalan,
+    # verify memakai snapshot lama). Packed: tulisan selama build disusul dari
+    # ekor manifest sebelum swap. npy: ada tulisan selama build -> hasil basi,
+    # ulangi; kalau terus basi, snapshot lama (sudah diperbarui writer) dipakai.
+    for _ in range(attempts):
+        v0 = _versions.get(group, 0)
+        g, sync = _build_gallery(group)
+        with _write_lock:
+            if sync is not None:
+                nxt = _advance(group, g, sync)
+                if nxt is not None:
+                    _publish(group, *nxt)
+                    return nxt[0]
+            elif _versions.get(group, 0) == v0:
+                _publish(group, g)
+                return g
+    print(f"[RELOAD][WARN] group={group or 'default'}: gallery changed during every rebuild, keeping current snapshot")
+    with _write_lock:
+        if group not in _galleries:
+            _publish(group, g, sync)  # load pertama: tetap dipakai, disusul reload berikutnya
+        return _galleries[group]
+
 def load_embeddings():
-    global emb_by_person
-    emb_by_person = {}
-    persons = [p for p in EMB_DIR.iterdir() if p.is_dir()]
-    for p in persons:
-        vecs = []
-        for f in p.iterdir():
-            if f.suffix.lower() == ".npy":
-                try:
-                    vecs.append(np.load(str(f)))
-                except Exception as e:
-                    print(f"[LOAD][ERROR] {f}: {e}")
-        if vecs:
-            emb_by_person[p.name] = vecs
-    print(f"[SUMMARY] persons={len(emb_by_person)} names={list(emb_by_person.keys())}")
-
-# (opsional) migrasi foto lama di faces/ -> embeddings/
-def migrate_faces_to_embeddings():
-    created = 0
-    persons = [p for p in FACES_DIR.iterdir() if p.is_dir()]
-    for p in persons:
-        out_dir = EMB_DIR / p.name
-        out_dir.mkdir(parents=True, exist_ok=True)
-        for imgp in p.iterdir():
-            if imgp.suffix.lower() not in (".jpg", ".jpeg", ".png"):
-                continue
-            target = out_dir / f"{imgp.stem}.npy"
-            if target.exists():
-                continue
-            try:
-                raw = imgp.read_bytes()
-                enc = _encode_image_bytes(raw, jitters=ENC_JITTERS)
-                if enc is not None:
-                    np.save(str(target), enc)
-                    created += 1
-            except Exception as e:
-                print(f"[MIGRATE][ERROR] {p.name}/{imgp.name}: {e}")
-    return {"success": True, "created": created, "emb_dir": str(EMB_DIR)}
+    # reload group default + semua group yang sedang dimuat
+    for group in [DEFAULT_GROUP] + [k for k in list(_galleries) if k != DEFAULT_GROUP]:
+        _reload_group(group)
+
+class ReloadJob:
+    # /reload-emb: rebuild dari disk di background, verify tetap dilayani
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.status: dict = {"state": "idle"}
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        with self._lock:
+            if self.running():
+                return False
+            self.status = dict(state="running", started=time.time(), finished=None)
+            self._thread = threading.Thread(target=self._run, name="reload-emb", daemon=True)
+            self._thread.start()
+            return True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.status)
+
+    def _run(self):
+        try:
+            load_embeddings()
+            with self._lock:
+                self.status.update(state="done", finished=time.time())
+        except Exception as e:
+            print(f"[RELOAD][ERROR] {e}")
+            with self._lock:
+                self.status.update(state="failed", error=str(e), finished=time.time())
+
+reloader = ReloadJob()
 
-# load saat startup
-load_embeddings()
-if AUTO_MIGRATE_FACES:
+def _existing_keys(group: str = DEFAULT_GROUP):
+    # {(nama.lower(), key)}: nama tidak peka huruf besar/kecil (lihat store.py)
+    if EMB_FORMAT == "packed":
+        st = _store(group)
+        keys = st.keys_of() if st.exists() else set()
+    else:
+        d = _emb_dir(group)
+        keys = {(name, key) for name, key, _ in iter_legacy(d)} if d.exists() else set()
+    return {(name.lower(), key) for name, key in keys}
+
+def _save_vector(person: str, key: str, enc: np.ndarray, group: str = DEFAULT_GROUP,
+                 replace: bool = False) -> Tuple[str, int]:
+    # -> (lokasi untuk log/response, nomor baris di packed store atau -1)
+    # replace: vektor lama dengan key yang sama tidak dipakai lagi
+    if EMB_FORMAT == "packed":
+        st = _store(group)
+        row = st.append([person], [key], enc[None, :], replace=replace)[0]
+        return f"{st.vec_path}#row={row}", row
+    d = _emb_dir(group) / _npy_name(person, group)
+    d.mkdir(parents=True, exist_ok=True)
+    path = d / f"{key}.npy"
+    np.save(str(path), enc)
+    return str(path), -1
+
+def _npy_name(person: str, group: str = DEFAULT_GROUP) -> str:
+    # layout npy: nama tidak case-sensitive (seperti folder di Windows), jadi
+    # "dinda" memakai folder embeddings/Dinda yang sudah ada, tidak jadi dua orang
+    d = _emb_dir(group)
+    if not d.exists() or (d / person).is_dir():
+        return person
+    for p in sorted(d.iterdir()):
+        if p.is_dir() and p.name.lower() == person.lower():
+            return p.name
+    return person
+
+def _without_npy(g: Gallery, person: str, group: str = DEFAULT_GROUP) -> Gallery:
+    # layout npy, setelah .npy dihapus: buang semua ejaan orang ini yang foldernya sudah kosong
+    for name in [n for n in g.persons() if n.lower() == person.lower()]:
+        if not any((_emb_dir(group) / name).glob("*.npy")):
+            g = g.without(name)[0]
+    return g
+
+def _reread_person(g: Gallery, person: str, group: str = DEFAULT_GROUP) -> Gallery:
+    # layout npy: .npy yang ditimpa -> baris orang ini dibaca ulang dari disk
+    person = _npy_name(person, group)
+    files = sorted((_emb_dir(group) / person).glob("*.npy"))
+    g = g.without(person)[0]
+    if not files:
+        return g
+    vecs = np.stack([np.asarray(np.load(str(f)), dtype=np.float32).ravel() for f in files])
+    return g.with_rows([person] * len(vecs), vecs)
+
+# ---------- Migrasi faces/ -> embeddings/ (background job) ----------
+# Foto di faces/<nama>/*.jpg di-encode paralel di semua core. State per file
+# (mtime, size, sha1, status) disimpan di _migrate_state.json, jadi file yang
+# tidak berubah dilewati dan job bisa dilanjutkan setelah crash.
+MIGRATE_STATE = EMB_DIR / "_migrate_state.json"
+_IMG_EXT = (".jpg", ".jpeg", ".png")
+
+def _migrate_encode_file(path: str, known_sha: Optional[str], jitters: int):
+    # jalan di worker process
+    raw = Path(path).read_bytes()
+    sha = hashlib.sha1(raw).hexdigest()
+    if sha == known_sha:
+        return sha, None, "same"
+    enc = _encode_image_bytes(raw, jitters=jitters)
+    return sha, enc, ("ok" if enc is not None else "noface")
+
+def _load_migrate_state() -> Dict[str, dict]:
     try:
-        res = migrate_faces_to_embeddings()
-        load_embeddings()
-        print(f"[AUTO] Migrated faces/ → embeddings/ on startup. created={res.get('created',0)}")
+        return json.loads(MIGRATE_STATE.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
     except Exception as e:
-        print(f"[AUTO][ERROR] migrate on startup: {e}")
+        print(f"[MIGRATE][ERROR] state file unreadable, starting fresh: {e}")
+        return {}
+
+def _save_migrate_state(state: Dict[str, dict]):
+    tmp = MIGRATE_STATE.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(state), encoding="utf-8")
+    os.replace(tmp, MIGRATE_STATE)
+
+class MigrationJob:
+    MAX_ERRORS_SHOWN = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.status: dict = {"state": "idle"}
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        with self._lock:
+            if self.running():
+                return False
+            self.status = dict(state="running", total=0, done=0, created=0, skipped=0,
+                               noface=0, failed=0, errors=[], started=time.time(), finished=None)
+            self._thread = threading.Thread(target=self._run, name="migrate-faces", daemon=True)
+            self._thread.start()
+            return True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            snap = dict(self.status)
+            if "errors" in snap:
+                snap["errors"] = snap["errors"][-self.MAX_ERRORS_SHOWN:]
+            return snap
+
+    def _bump(self, **kw):
+        with self._lock:
+            for k, v in kw.items():
+                self.status[k] += v
+
+    def _scan(self, state: Dict[str, dict]):
+        have = _existing_keys()
+        todo = []
+        for p in sorted(FACES_DIR.iterdir()):
+            if not p.is_dir() or p.name.startswith("_"):
+                continue
+            for imgp in sorted(p.iterdir()):
+                if imgp.suffix.lower() not in _IMG_EXT:
+                    continue
+                rel = f"{p.name}/{imgp.name}"
+                stt = imgp.stat()
+                prev = state.get(rel) or {}
+                stored = (p.name.lower(), imgp.stem) in have
+                unchanged = prev.get("mtime") == stt.st_mtime and prev.get("size") == stt.st_size
+                if unchanged and ((prev.get("status") == "done" and stored) or prev.get("status") == "noface"):
+                    self._bump(skipped=1)
+                    continue
+                if not prev and stored:
+                    # vektor sudah ada dari migrasi versi lama
+                    state[rel] = dict(mtime=stt.st_mtime, size=stt.st_size, sha1=None, status="done")
+                    self._bump(skipped=1)
+                    continue
+                # vektor yang sudah dihapus (/delete-embeddings) di-encode ulang, seperti dulu
+                ok_before = (prev.get("status") == "done" and stored) or prev.get("status") == "noface"
+                known = prev.get("sha1") if ok_before else None
+                todo.append((rel, p.name, imgp, stt, known, stored))
+        return todo
+
+    def _run(self):
+        try:
+            state = _load_migrate_state()
+            todo = self._scan(state)
+            with self._lock:
+                self.status["total"] = len(todo)
+            last_save = time.time()
+            with ProcessPoolExecutor(max_workers=max(MIGRATE_WORKERS, 1)) as ex:
+                futs = {ex.submit(_migrate_encode_file, str(imgp), known, ENC_JITTERS): (rel, person, imgp, stt, stored)
+                        for rel, person, imgp, stt, known, stored in todo}
+                for fut in as_completed(futs):
+                    rel, person, imgp, stt, stored = futs[fut]
+                    entry = dict(mtime=stt.st_mtime, size=stt.st_size)
+                    try:
+                        sha, enc, res = fut.result()
+                        entry["sha1"] = sha
+                        if res == "ok":
+                            with _write_lock:
+                                # foto diganti (key sama) -> vektor lama ikut diganti, bukan ditambah
+                                _, row = _save_vector(person, imgp.stem, enc, replace=stored)
+                                # langsung ikut dipakai verify
+                                _update(DEFAULT_GROUP, (lambda g: _reread_person(g, person)) if stored
+                                        else (lambda g: g.with_added(_npy_name(person), enc, src=[row])))
+                            entry["status"] = "done"
+                            self._bump(created=1)
+                        elif res == "noface":
+                            entry["status"] = "noface"
+                            self._bump(noface=1)
+                        else:
+                            entry["status"] = state.get(rel, {}).get("status", "done")
+                            self._bump(skipped=1)
+                    except Exception as e:
+                        entry.update(status="error", error=f"{type(e).__name__}: {e}")
+                        print(f"[MIGRATE][ERROR] {rel}: {e}")
+                        with self._lock:
+                            self.status["failed"] += 1
+                            self.status["errors"].append({"file": rel, "error": entry["error"]})
+                    state[rel] = entry
+                    self._bump(done=1)
+                    if time.time() - last_save > 2.0:
+                        _save_migrate_state(state)
+                        last_save = time.time()
+            _save_migrate_state(state)
+            with self._lock:
+                self.status.update(state="done", finished=time.time())
+            print(f"[MIGRATE] done: {self.snapshot()}")
+        except Exception as e:
+            print(f"[MIGRATE][ERROR] job failed: {e}")
+            with self._lock:
+                self.status.update(state="failed", error=str(e), finished=time.time())
+
+migration = MigrationJob()
+_warm_state = {"ready": False, "seconds": None}
+
+# load saat startup (bukan saat import, supaya worker pool tidak ikut load)
+@app.on_event("startup")
+def _startup():
+    load_embeddings()
+    if AUTO_MIGRATE_FACES:
+        migration.start()  # jalan di background, startup tidak menunggu
+        print("[AUTO] faces/ → embeddings/ migration started in background")
+    _start_pool()
+    print(f"[POOL] encoder workers={ENC_WORKERS} queue_max={ENC_QUEUE}"
+          + (f" batch_window={BATCH_WINDOW_MS}ms batch_max={BATCH_MAX}" if BATCH_WINDOW_MS > 0 else ""))
+    if WARMUP:
+        # uvicorn baru menerima request (termasuk /health) setelah startup selesai
+        t = time.perf_counter()
+        _warm()
+        if _pool is not None:
+            warm = _warm_pool()  # spawn + import + model di tiap worker
+            if warm < ENC_WORKERS:
+                print(f"[WARMUP][WARN] only {warm}/{ENC_WORKERS} encoder workers answered")
+        _best_match(np.zeros(128))  # BLAS / matrix galeri
+        _warm_state["seconds"] = round(time.perf_counter() - t, 3)
+        print(f"[WARMUP] done in {_warm_state['seconds']}s")
+    _warm_state["ready"] = True
+
+@app.on_event("shutdown")
+def _shutdown():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
 
 # ---------- Matching ----------
-def _best_match(cand: np.ndarray):
-    best_name, best, second = None, 1e9, 1e9
-    for name, vecs in emb_by_person.items():
-        d = np.linalg.norm(np.array(vecs) - cand, axis=1)  # Euclidean
-        dmin = float(np.min(d))
-        if dmin < best:
-            second = best
-            best = dmin
-            best_name = name
-        elif dmin < second:
-            second = dmin
-    return best_name or "", best, second
+def _near_boundary(best: float, second: float) -> bool:
+    # galeri compact: hasil sedekat ini ke TOLERANCE/MARGIN_GAP dicek ulang pakai float32
+    return abs(best - TOLERANCE) < RECHECK_EPS or abs((second - best) - MARGIN_GAP) < RECHECK_EPS
+
+def _fresh(group: str) -> bool:
+    # sudah dimuat dan tidak ada tulisan baru di store (murah: satu baca mmap)
+    if group not in _galleries:
+        return False
+    sync = _sync.get(group)
+    return sync is None or _store(group).generation() == sync[0]
+
+async def _snapshots(groups: Tuple[str, ...]) -> List[Gallery]:
+    # snapshot per group untuk verify; load pertama (bisa termasuk
+    # convert_legacy) dan catch-up tulisan baru (menunggu _write_lock, baca
+    # manifest, build ulang setelah compact) jalan di thread, bukan di event loop
+    if all(_fresh(g) for g in groups):
+        return [_gallery(g) for g in groups]
+    return await asyncio.get_running_loop().run_in_executor(None, lambda: [_gallery(g) for g in groups])
+
+def _best_match(cand: np.ndarray, gals: Optional[List[Gallery]] = None):
+    # satu GEMV + min per orang (segmented) per group, lihat Gallery.rank;
+    # beberapa group digabung per nama (merge_ranked). Default: group default.
+    recheck = _near_boundary if RECHECK_EPS > 0 else None
+    gals = gals if gals is not None else [_gallery()]
+    if len(gals) == 1:
+        return gals[0].match(cand, recheck=recheck)
+    return best_second(merge_ranked(g.rank(cand, recheck=recheck) for g in gals))
+
+def _best_match_batch(cands: np.ndarray, gals: List[Gallery]) -> List[Tuple[str, float, float]]:
+    # _best_match untuk B probe sekaligus (Gallery.rank_batch: satu GEMM per group)
+    recheck = _near_boundary if RECHECK_EPS > 0 else None
+    per_group = [g.rank_batch(cands, recheck=recheck) for g in gals]
+    return [best_second(merge_ranked(r[j] for r in per_group)) for j in range(len(cands))]
+
+# ---------- Micro-batching verify ----------
+# Saat jam masuk banyak verify datang bersamaan. Decode + deteksi + align
+# (bagian yang mahal) tetap satu job pool per request, jadi jalan paralel di
+# semua worker. Chip wajah yang selesai dalam BATCH_WINDOW_MS (maks
+# BATCH_MAX) di-encode dengan satu panggilan dlib (_encode_chips), lalu
+# dicocokkan dengan satu GEMM per group. Semua state hanya disentuh dari event loop.
+class VerifyBatcher:
+    def __init__(self, window_ms: float, max_size: int):
+        self.window = window_ms / 1000.0
+        self.max_size = max(max_size, 1)
+        self._pending: list = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def submit(self, raw: bytes, groups: Tuple[str, ...], timings: Optional[Dict[str, float]] = None):
+        # -> (enc, (nama, best, second)); enc None = tidak ada wajah
+        _admit()
+        try:
+            t0 = time.perf_counter()
+            chip, enc, worker_t = await _pool_call(_align_face, raw, 1)  # verifikasi ringan
+            if timings is not None:
+                timings.update(worker_t)
+                timings["queue"] = max(time.perf_counter() - t0 - sum(worker_t.values()), 0.0)
+            if chip is None and enc is None:
+                return None, None
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            self._pending.append((chip, enc, groups, time.perf_counter(), fut, timings))
+            if len(self._pending) >= self.max_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+            return await fut
+        finally:
+            _release()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list):
+        t0 = time.perf_counter()
+        M_BATCH_SIZE.observe(len(batch))
+        for _, _, _, t_in, _, timings in batch:
+            M_BATCH_WAIT.observe(t0 - t_in)
+            if timings is not None:
+                timings["batch_wait"] = t0 - t_in
+        try:
+            encs = [b[1] for b in batch]
+            idx = [i for i, b in enumerate(batch) if b[0] is not None]
+            encode_s = pool_s = 0.0
+            if idx:
+                descs, encode_s = await _pool_call(_encode_chips, [batch[i][0] for i in idx], 1)
+                pool_s = time.perf_counter() - t0
+                for i, d in zip(idx, descs):
+                    encs[i] = d
+            matches = [None] * len(batch)
+            by_groups: Dict[Tuple[str, ...], List[int]] = {}
+            for i, b in enumerate(batch):
+                if encs[i] is not None:
+                    by_groups.setdefault(b[2], []).append(i)
+            t = time.perf_counter()
+            for groups, members in by_groups.items():
+                gals = await _snapshots(groups)
+                for i, m in zip(members, _best_match_batch(np.stack([encs[i] for i in members]), gals)):
+                    matches[i] = m
+            match_s = time.perf_counter() - t
+        except Exception as e:
+            for b in batch:
+                if not b[4].done():
+                    b[4].set_exception(e)
+            return
+        for i, (chip, _, _, _, fut, timings) in enumerate(batch):
+            if fut.done():
+                continue  # client sudah pergi
+            if timings is not None:
+                if chip is not None:
+                    timings["encode"] = encode_s / len(idx)  # waktu encode batch dibagi rata
+                    timings["queue"] = timings.get("queue", 0.0) + max(pool_s - encode_s, 0.0)
+                timings["match"] = match_s
+            fut.set_result((encs[i], matches[i]))
+
+_batcher = VerifyBatcher(BATCH_WINDOW_MS, BATCH_MAX)
+
+def _parse_groups(group: Optional[str]) -> Tuple[str, ...]:
+    # "site-a, site-b" -> ("site-a", "site-b"); kosong -> group default
+    keys = tuple(dict.fromkeys(_group_key(g) for g in (group or "").split(",") if g.strip()))
+    return keys or (DEFAULT_GROUP,)
 
 class DeleteEmbeddingsRequest(BaseModel):
     name: str
     delete_faces: bool = False
+    group: str = ""
 
 # ---------- Endpoints ----------
 @app.get("/health")
 def health():
+    gallery = _gallery()
+    loaded = list(_galleries)
     return {
         "ok": True,
-        "persons": len(emb_by_person),
-        "names": list(emb_by_person.keys()),
+        "ready": _warm_state["ready"],
+        "warmup_s": _warm_state["seconds"],
+        "pid": os.getpid(),
+        "persons": gallery.num_persons,
+        "vectors": len(gallery),
+        "names": gallery.persons(),
+        "groups": _groups_on_disk(),
+        "groups_loaded": [g for g in loaded if g != DEFAULT_GROUP],
         "config": dict(
             tolerance=TOLERANCE, margin_gap=MARGIN_GAP,
-            upsample=UPSAMPLE, model=MODEL, max_width=MAX_WIDTH, jitter=ENC_JITTERS,
-            auto_migrate_faces=AUTO_MIGRATE_FACES,
+            upsample=UPSAMPLE, model=MODEL, max_width=MAX_WIDTH, max_pixels=MAX_PIXELS,
+            detect_width=DETECT_WIDTH, encode_max_width=ENCODE_MAX_WIDTH, jitter=ENC_JITTERS,
+            auto_migrate_faces=AUTO_MIGRATE_FACES, emb_format=EMB_FORMAT,
+            ann=gallery.index is not None, ann_nprobe=ANN_NPROBE,
+            gallery_dtype=GALLERY_DTYPE, gallery_bytes=gallery.nbytes(),
+            workers=ENC_WORKERS, queue_max=ENC_QUEUE, max_loaded_groups=MAX_LOADED_GROUPS,
+            batch_window_ms=BATCH_WINDOW_MS, batch_max=BATCH_MAX, shared_mmap=SHARED_MMAP,
         )
     }
 
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/faces")
-def faces():
-    return {"count": len(emb_by_person), "names": list(emb_by_person.keys())}
+def faces(group: str = ""):
+    g = _gallery(_group_key(group))
+    return {"count": g.num_persons, "names": g.persons()}
+
+@app.get("/groups")
+def groups():
+    loaded = {k: {"persons": g.num_persons, "vectors": len(g), "bytes": g.nbytes()}
+              for k, g in list(_galleries.items()) if k != DEFAULT_GROUP}
+    return {"groups": _groups_on_disk(), "loaded": loaded, "max_loaded": MAX_LOADED_GROUPS}
+
+@app.post("/groups/{group}/evict")
+def evict_group(group: str):
+    key = _group_key(group)
+    with _write_lock:
+        evicted = key != DEFAULT_GROUP and _galleries.pop(key, None) is not None
+    return {"success": True, "group": key, "evicted": evicted}
 
 @app.post("/reload-emb")
 def reload_emb():
-    load_embeddings()
-    return {"success": True, "count": len(emb_by_person)}
+    # rebuild di background; verify tetap memakai snapshot lama sampai swap
+    started = reloader.start()
+    return {"success": True, "started": started, "job": reloader.snapshot(), "count": _gallery().num_persons}
+
+@app.get("/reload-status")
+def reload_status():
+    return reloader.snapshot()
 
-# Trigger manual: scan faces/ -> embeddings/ lalu reload
+# Trigger manual: scan faces/ -> embeddings/ (background); progress lewat /migrate-status
 @app.post("/reload-from-faces")
 def reload_from_faces():
-    res = migrate_faces_to_embeddings()
-    load_embeddings()
-    return {"success": True, "created": res.get("created", 0), "count": len(emb_by_person)}
+    started = migration.start()
+    return {"success": True, "started": started, "job": migration.snapshot()}
+
+@app.get("/migrate-status")
+def migrate_status():
+    return {"success": True, "job": migration.snapshot(), "count": _gallery().num_persons}
 
 @app.post("/delete-embeddings")
 def delete_embeddings(payload: DeleteEmbeddingsRequest):
+    group = _group_key(payload.group)
     try:
         person = _slug(payload.name)
         deleted = 0
-
-        emb_dir = EMB_DIR / person
-        if emb_dir.exists():
-            for f in emb_dir.iterdir():
-                if f.is_file() and f.suffix.lower() == ".npy":
-                    f.unlink()
-                    deleted += 1
-            if not any(emb_dir.iterdir()):
-                emb_dir.rmdir()
+        with _write_lock:
+            if EMB_FORMAT == "packed":
+                deleted = _store(group).delete(person)  # tombstone; file lama di bawah ikut dibersihkan
+            # file dihapus sebelum snapshot baru dipublikasikan: reload yang
+            # mulai sesudahnya tidak bisa lagi membaca orang ini dari disk
+            root = _emb_dir(group)
+            for emb_dir in (sorted(root.iterdir()) if root.exists() else []):
+                if not emb_dir.is_dir() or emb_dir.name.lower() != person:
+                    continue  # semua ejaan: Dinda/ dan dinda/ orang yang sama
+                for f in emb_dir.iterdir():
+                    if f.is_file() and f.suffix.lower() == ".npy":
+                        f.unlink()
+                        if EMB_FORMAT != "packed":
+                            deleted += 1
+                if not any(emb_dir.iterdir()):
+                    emb_dir.rmdir()
+            # snapshot baru tanpa baris orang ini, index ANN ikut diperbarui
+            _update(group, lambda g: _without_npy(g, person, group))
 
         if payload.delete_faces:
             faces_dir = FACES_DIR / person
@@ -237,77 +1079,441 @@ def delete_embeddings(payload: DeleteEmbeddingsRequest):
                 if not any(faces_dir.iterdir()):
                     faces_dir.rmdir()
 
-        load_embeddings()
-        return {"success": True, "person": person, "deleted": deleted}
+        return {"success": True, "person": person, "group": group, "deleted": deleted}
     except Exception as e:
         return {"success": False, "message": str(e)}
 
-# Enroll: terima foto → encode → simpan .npy
+# Enroll: terima foto → encode → simpan vektor
 @app.post("/enroll")
-async def enroll(name: str = Form(...), image: UploadFile = File(...)):
+async def enroll(response: Response, name: str = Form(...), image: UploadFile = File(...),
+                 group: str = Form("")):
+    timings: Dict[str, float] = {}
+    group = _group_key(group)
+    t = time.perf_counter()
     raw = await image.read()
+    t = _lap(timings, "read", t)
     if not raw:
+        M_ENROLL.inc("empty")
         return {"success": False, "message": "Empty file"}
     try:
-        enc = _encode_image_bytes(raw, jitters=ENC_JITTERS)
+        enc = await _encode_async(raw, jitters=ENC_JITTERS, timings=timings)
+    except HTTPException:
+        M_ENROLL.inc("busy")
+        raise
     except Exception as e:
         msg = str(e)
         print(f"[ENROLL][ERROR] {msg}")
+        M_ENROLL.inc("invalid_image")
         if "Unsupported image type" in msg:
             return {"success": False, "message": "Format gambar tidak didukung. Gunakan JPG/PNG 8-bit."}
         return {"success": False, "message": f"Invalid image: {type(e).__name__}"}
     if enc is None:
+        M_ENROLL.inc("no_face")
         return {"success": False, "message": "No face found/encoded"}
 
     person = _slug(name)
-    d = EMB_DIR / person
-    d.mkdir(parents=True, exist_ok=True)
-    path = d / f"{int(time.time()*1000)}.npy"
-    np.save(str(path), enc)
 
-    load_embeddings()  # refresh cache
-    return {"success": True, "person": person, "saved": str(path)}
+    def store() -> str:
+        # append + fsync di thread: _write_lock tidak pernah ditunggu di event loop
+        with _write_lock:
+            path, row = _save_vector(person, str(int(time.time()*1000)), enc, group)
+            # hanya vektor baru yang ditambahkan (snapshot baru), tanpa rescan disk
+            _update(group, lambda g: g.with_added(_npy_name(person, group), enc, src=[row]))
+        return path
+
+    t = time.perf_counter()
+    path = await asyncio.get_running_loop().run_in_executor(None, store)
+    _lap(timings, "store", t)
+    _observe(timings)
+    M_ENROLL.inc("enrolled")
+    response.headers["Server-Timing"] = metrics.server_timing(timings)
+    return {"success": True, "person": person, "group": group, "saved": str(path)}
+
+# ---------- Bulk enroll dari arsip ----------
+# POST /enroll-bulk?group=..., body = arsip tar (boleh .gz/.bz2/.xz) atau zip
+# berisi <nama>/<foto>.jpg. Tar dibaca streaming (tarfile "r|*") langsung dari
+# body request; zip butuh central directory di akhir file, jadi di-spool ke
+# file sementara (disk, bukan RAM). Foto di-encode paralel di encoder pool,
+# semua vektor ditulis sekali (satu append + fsync) dan galeri diperbarui
+# sekali. Response: NDJSON, satu baris per file, baris terakhir ringkasan.
+_bulk_lock = threading.Lock()  # satu bulk enroll dalam satu waktu
+
+class _ChunkReader(io.RawIOBase):
+    # file-like read-only di atas queue chunk body request (None = selesai)
+    def __init__(self, chunks: "queue.Queue[Optional[bytes]]"):
+        self._chunks = chunks
+        self._buf = bytearray()
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self, n: int):
+        while (n < 0 or len(self._buf) < n) and not self._eof:
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buf += chunk
+
+    def peek(self, n: int) -> bytes:
+        self._fill(n)
+        return bytes(self._buf[:n])
+
+    def read(self, n: int = -1) -> bytes:
+        self._fill(n)
+        n = len(self._buf) if n < 0 else min(n, len(self._buf))
+        out = bytes(self._buf[:n])
+        del self._buf[:n]
+        return out
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+def _archive_entries(src: _ChunkReader):
+    # -> (path, size, read()) per file; read() hanya dipanggil untuk file yang dipakai
+    if src.peek(2) == b"PK":
+        with tempfile.TemporaryFile() as tmp:
+            shutil.copyfileobj(src, tmp)
+            tmp.seek(0)
+            with zipfile.ZipFile(tmp) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir():
+                        yield info.filename, info.file_size, (lambda info=info: zf.read(info))
+        return
+    with tarfile.open(fileobj=src, mode="r|*") as tf:
+        for m in tf:
+            if m.isfile():
+                yield m.name, m.size, (lambda m=m: tf.extractfile(m).read())
+
+class BulkEnroll:
+    def __init__(self, group: str, emit):
+        self.group = group
+        self.emit = emit  # thread-safe; None = stream selesai
+        self.cancelled = False
+        self.counts: Dict[str, int] = {}
+
+    def _report(self, path: str, person: str, status: str, **extra):
+        self.counts[status] = self.counts.get(status, 0) + 1
+        self.emit(dict(file=path, person=person, status=status, **extra))
+
+    def run(self, src: _ChunkReader, release):
+        # release() (lepas _bulk_lock) sebelum ringkasan dikirim: client yang
+        # langsung upload ulang setelah membaca baris terakhir tidak kena 409
+        t0 = time.perf_counter()
+        try:
+            summary = self._run(src, t0)
+        except Exception as e:
+            print(f"[BULK][ERROR] {e}")
+            summary = {"done": True, "success": False, "message": f"{type(e).__name__}: {e}", "counts": self.counts}
+        finally:
+            release()
+        if summary is not None:
+            self.emit(summary)
+        self.emit(None)
+
+    def _submit(self, raw: bytes) -> Future:
+        # lewat accounting yang sama dengan verify (_inflight), jadi admission
+        # control dan gauge face_encoder_inflight ikut melihat job bulk
+        if _pool is not None:
+            _hold()
+            try:
+                fut = _pool.submit(_encode_timed, raw, ENC_JITTERS)
+            except Exception:
+                _release()
+                raise
+            fut.add_done_callback(lambda _: _release())
+            return fut
+        fut: Future = Future()
+        try:
+            fut.set_result(_encode_timed(raw, ENC_JITTERS))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+    def _collect(self, pending: Dict[Future, tuple], encoded: list, return_when: str):
+        done, _ = wait(list(pending), return_when=return_when)
+        for fut in done:
+            path, person, key = pending.pop(fut)
+            try:
+                enc, _ = fut.result()
+            except Exception as e:
+                M_ENROLL.inc("invalid_image")
+                self._report(path, person, "invalid_image", message=f"{type(e).__name__}: {e}")
+                continue
+            if enc is None:
+                M_ENROLL.inc("no_face")
+                self._report(path, person, "no_face")
+                continue
+            encoded.append((person, key, enc))
+            self._report(path, person, "ok")
+
+    def _run(self, src: _ChunkReader, t0: float):
+        have = _existing_keys(self.group)
+        seen: Dict[Tuple[str, str], str] = {}  # (person, key) di arsip ini -> path pertama
+        max_bytes = BULK_MAX_FILE_MB * 1024 * 1024
+        pending: Dict[Future, tuple] = {}
+        encoded: List[Tuple[str, str, np.ndarray]] = []
+        limit = max(ENC_WORKERS - 1, 1)  # job di pool sekaligus; minimal satu worker tersisa untuk verify
+        for path, size, read in _archive_entries(src):
+            if self.cancelled:
+                break
+            parts = PurePosixPath(path).parts
+            fname = PurePosixPath(path).name
+            if fname.startswith(".") or "__MACOSX" in parts:
+                continue  # metadata OS, bukan foto
+            # tanpa fallback user_<ts> seperti _slug: nama yang kosong setelah
+            # dibersihkan dilewati, bukan jadi orang/key baru setiap detik
+            person = _name_key(parts[-2]) if len(parts) >= 2 else ""
+            key = _name_key(PurePosixPath(fname).stem)
+            if not person or person[0] in "._":
+                self._report(path, person, "skipped", message="harus <nama>/<foto>")
+            elif not key:
+                self._report(path, person, "skipped", message="nama file tanpa huruf/angka")
+            elif PurePosixPath(fname).suffix.lower() not in _IMG_EXT:
+                self._report(path, person, "skipped", message="bukan JPG/PNG")
+            elif size > max_bytes:
+                self._report(path, person, "skipped", message=f"lebih dari {BULK_MAX_FILE_MB:g} MB")
+            elif (person, key) in seen:
+                # "IMG 1.jpg" dan "img_1.JPG" -> key yang sama di arsip yang sama
+                self._report(path, person, "conflict", message=f"key {key} sama dengan {seen[(person, key)]}")
+            elif (person, key) in have:
+                seen[(person, key)] = path
+                self._report(path, person, "exists")
+            else:
+                seen[(person, key)] = path
+                pending[self._submit(read())] = (path, person, key)
+                while len(pending) >= limit:
+                    self._collect(pending, encoded, FIRST_COMPLETED)
+        while pending and not self.cancelled:
+            self._collect(pending, encoded, FIRST_COMPLETED)
+        if self.cancelled:
+            for fut in pending:
+                fut.cancel()
+            return None  # client putus: tidak ada yang disimpan
+
+        t = time.perf_counter()
+        if encoded:
+            names = [e[0] for e in encoded]
+            keys = [e[1] for e in encoded]
+            vecs = np.stack([e[2] for e in encoded]).astype(np.float32)
+            with _write_lock:
+                if EMB_FORMAT == "packed":
+                    rows = np.asarray(_store(self.group).append(names, keys, vecs))  # satu batch, satu fsync
+                else:
+                    rows = None
+                    for person, key, enc in zip(names, keys, vecs):
+                        _save_vector(person, key, enc, self.group)
+                    folder = {n: _npy_name(n, self.group) for n in set(names)}
+                    names = [folder[n] for n in names]
+                # galeri diperbarui sekali
+                _update(self.group, lambda g: g.with_rows(names, vecs, src=rows))
+            M_ENROLL.inc("enrolled", amount=len(encoded))
+        return {"done": True, "success": True, "group": self.group, "saved": len(encoded),
+                "persons": len({e[0] for e in encoded}), "counts": self.counts,
+                "store_s": round(time.perf_counter() - t, 3), "total_s": round(time.perf_counter() - t0, 3)}
+
+@app.post("/enroll-bulk")
+async def enroll_bulk(request: Request, group: str = ""):
+    group = _group_key(group)
+    if not _bulk_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Bulk enroll lain sedang berjalan.")
+    loop = asyncio.get_running_loop()
+    chunks: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=64)  # backpressure ke upload
+    out: asyncio.Queue = asyncio.Queue()
+    job = BulkEnroll(group, lambda item: loop.call_soon_threadsafe(out.put_nowait, item))
+
+    reader = threading.Thread(target=job.run, args=(_ChunkReader(chunks), _bulk_lock.release),
+                              name="enroll-bulk", daemon=True)
+    reader.start()
+
+    def feed(item: Optional[bytes]) -> bool:
+        # blocking put; berhenti kalau thread pembaca sudah selesai (arsip rusak dsb.)
+        while reader.is_alive():
+            try:
+                chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # Body diteruskan per chunk ke thread pembaca (tidak ditampung utuh);
+    # encode sudah jalan selama upload. Body harus habis dibaca di sini:
+    # StreamingResponse ikut membaca `receive` untuk deteksi disconnect.
+    try:
+        async for chunk in request.stream():
+            if chunk and not await loop.run_in_executor(None, feed, chunk):
+                break
+    except Exception:
+        job.cancelled = True
+        raise
+    finally:
+        await loop.run_in_executor(None, feed, None)
+
+    async def stream():
+        try:
+            while True:
+                item = await out.get()
+                if item is None:
+                    return
+                yield (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+        finally:
+            job.cancelled = True  # client putus sebelum selesai -> tidak ada yang disimpan
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 # Verify (dua path kompatibel)
-async def _verify_core(upload: UploadFile):
+def _verify_result(outcome: str, body: dict) -> dict:
+    M_VERIFY.inc(outcome)
+    return body
+
+async def _verify_core(upload: UploadFile, timings: Optional[Dict[str, float]] = None,
+                       groups: Tuple[str, ...] = (DEFAULT_GROUP,)):
+    t = time.perf_counter()
     raw = await upload.read()
+    _lap(timings, "read", t)
     if not raw:
-        return {"success": False, "message": "Empty file"}
+        return _verify_result("empty", {"success": False, "message": "Empty file"})
 
+    match = None
     try:
-        enc = _encode_image_bytes(raw, jitters=1)  # verifikasi ringan
+        if BATCH_WINDOW_MS > 0:
+            enc, match = await _batcher.submit(raw, groups, timings)  # encode + match dalam micro-batch
+        else:
+            enc = await _encode_async(raw, jitters=1, timings=timings)  # verifikasi ringan
+    except HTTPException:
+        M_VERIFY.inc("busy")
+        raise
     except Exception as e:
         msg = str(e)
         print(f"[VERIFY][ERROR] {msg}")
         if "Unsupported image type" in msg:
-            return {"success": False, "message": "Format gambar tidak didukung. Gunakan JPG/PNG 8-bit."}
-        return {"success": False, "message": f"Invalid image: {type(e).__name__}"}
+            return _verify_result("invalid_image", {"success": False, "message": "Format gambar tidak didukung. Gunakan JPG/PNG 8-bit."})
+        return _verify_result("invalid_image", {"success": False, "message": f"Invalid image: {type(e).__name__}"})
     if enc is None:
-        return {"success": False, "message": "No face found/encoded"}
+        return _verify_result("no_face", {"success": False, "message": "No face found/encoded"})
 
-    if not emb_by_person:
-        return {"success": False, "message": "No enrolled vectors"}
+    if match is None:
+        gals = await _snapshots(groups)
+        t = time.perf_counter()
+        match = _best_match(enc, gals)
+        _lap(timings, "match", t)
+    return _decide(*match)
 
-    name, best, second = _best_match(enc)
+def _decide(name: str, best: float, second: float) -> dict:
+    # keputusan TOLERANCE/MARGIN_GAP, sama untuk verify foto dan embedding
+    if not name:
+        return _verify_result("no_gallery", {"success": False, "message": "No enrolled vectors"})
 
     if best > TOLERANCE:
-        return {"success": False, "message": "Gagal: Wajah Tidak Dikenali", "best": best, "tol": TOLERANCE}
+        return _verify_result("unknown", {"success": False, "message": "Gagal: Wajah Tidak Dikenali", "best": best, "tol": TOLERANCE})
 
     if (second - best) < MARGIN_GAP:
-        return {"success": False, "message": "Ambiguous (gap too small)", "best": best, "second": second, "gap": second - best}
+        return _verify_result("ambiguous", {"success": False, "message": "Ambiguous (gap too small)", "best": best, "second": second, "gap": second - best})
 
-    return {"success": True, "user": name, "distance": best, "gap": second - best, "tolerance": TOLERANCE}
+    return _verify_result("matched", {"success": True, "user": name, "distance": best, "gap": second - best, "tolerance": TOLERANCE})
 
-@app.post("/verify-face")
-async def verify_face(image: UploadFile = File(...)):
+async def _verify_endpoint(image: UploadFile, response: Response, endpoint: str, group: str = ""):
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
     try:
-        return await _verify_core(image)
+        return await _verify_core(image, timings, _parse_groups(group))
+    except HTTPException:
+        raise
     except Exception as e:
+        M_VERIFY.inc("error")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        timings["total"] = time.perf_counter() - t0
+        M_REQUEST.observe(timings["total"], endpoint)
+        _observe({k: v for k, v in timings.items() if k != "total"})
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+
+@app.post("/verify-face")
+async def verify_face(response: Response, image: UploadFile = File(...), group: str = Form("")):
+    return await _verify_endpoint(image, response, "/verify-face", group)
 
 @app.post("/api/verify-face")
-async def verify_face_api(image: UploadFile = File(...)):
+async def verify_face_api(response: Response, image: UploadFile = File(...), group: str = Form("")):
+    return await _verify_endpoint(image, response, "/api/verify-face", group)
+
+# ---------- Verify dari embedding (tanpa upload foto) ----------
+# Kiosk / on-device yang sudah punya encoding 128-d (dlib/face_recognition)
+# langsung ke matching: tanpa decode, resize, deteksi, encode.
+#   - body application/octet-stream: N x 128 float32 little-endian (512 byte/vektor),
+#     group lewat query ?group=
+#   - body JSON: {"embedding": "<base64 512 byte>"} atau {"embeddings": [...], "group": "..."}
+# Satu vektor -> response sama seperti /verify-face; batch -> {"results": [...]}.
+_EMB_BYTES = 128 * 4
+_EMB_B64 = (_EMB_BYTES + 2) // 3 * 4  # 684 karakter base64 per vektor
+
+class VerifyEmbeddingRequest(BaseModel):
+    embedding: Optional[str] = None
+    embeddings: Optional[List[str]] = None
+    group: str = ""
+
+def _parse_vectors(raw: bytes) -> np.ndarray:
+    if not raw or len(raw) % _EMB_BYTES:
+        raise ValueError(f"panjang vektor harus kelipatan {_EMB_BYTES} byte (float32 x 128)")
+    vecs = np.frombuffer(raw, dtype="<f4").reshape(-1, 128)
+    if not np.isfinite(vecs).all():
+        raise ValueError("vektor berisi NaN/Inf")
+    return vecs.astype(np.float64)
+
+@app.post("/verify-embedding")
+async def verify_embedding(request: Request, response: Response, group: str = ""):
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
     try:
-        return await _verify_core(image)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        t = time.perf_counter()
+        is_json = request.headers.get("content-type", "").startswith("application/json")
+        batch = False
+        try:
+            # batas body dari EMB_BATCH_MAX, dicek sebelum/selama dibaca: body besar
+            # ditolak tanpa ditampung dulu di RAM. JSON: base64 + kutip/spasi per
+            # item, plus sisa untuk key dan group
+            limit = (EMB_BATCH_MAX * (_EMB_B64 + 16) + 4096) if is_json else EMB_BATCH_MAX * _EMB_BYTES
+            too_big = ValueError(f"body lebih dari {limit} byte (maksimum {EMB_BATCH_MAX} vektor per request)")
+            if int(request.headers.get("content-length") or 0) > limit:
+                raise too_big
+            buf = bytearray()
+            async for chunk in request.stream():
+                buf += chunk
+                if len(buf) > limit:
+                    raise too_big
+            raw = bytes(buf)
+            if is_json:
+                data = json.loads(raw or b"{}")
+                if not isinstance(data, dict):
+                    raise ValueError("body JSON harus object")
+                payload = VerifyEmbeddingRequest(**data)
+                items = payload.embeddings if payload.embeddings is not None else (
+                    [payload.embedding] if payload.embedding else [])
+                batch = payload.embeddings is not None
+                group = payload.group or group
+                if len(items) > EMB_BATCH_MAX:
+                    raise ValueError(f"maksimum {EMB_BATCH_MAX} vektor per request")
+                raw = b"".join(base64.b64decode(x, validate=True) for x in items)
+            vecs = _parse_vectors(raw)
+            batch = batch or len(vecs) > 1
+            if len(vecs) > EMB_BATCH_MAX:
+                raise ValueError(f"maksimum {EMB_BATCH_MAX} vektor per request")
+        except (ValueError, TypeError, binascii.Error) as e:
+            return _verify_result("invalid_embedding", {"success": False, "message": f"Invalid embedding: {e}"})
+        _lap(timings, "read", t)
+
+        gals = await _snapshots(_parse_groups(group))
+        t = time.perf_counter()
+        matches = _best_match_batch(vecs, gals)
+        _lap(timings, "match", t)
+        results = [_decide(*m) for m in matches]
+        if not batch:
+            return results[0]
+        return {"success": True, "count": len(results), "results": results}
+    finally:
+        timings["total"] = time.perf_counter() - t0
+        M_REQUEST.observe(timings["total"], "/verify-embedding")
+        _observe({k: v for k, v in timings.items() if k != "total"})
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
@@ -0,0 +1,108 @@
+# metrics.py — counter/histogram/gauge minimal untuk /metrics (format teks Prometheus)
+# Tanpa dependensi tambahan; observe() cuma bisect + increment di bawah lock.
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+REGISTRY: List["_Metric"] = []
+
+# detik; cocok untuk stage ~1ms sampai request ~30s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels -> [counts..., sum, count]
+
+    def observe(self, value: float, *labelvalues: str):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labelvalues)
+            if s is None:
+                s = self._series[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        out = self._header()
+        for k, s in items:
+            acc = 0
+            for b, c in zip(self.buckets, s):
+                acc += c
+                le = _fmt_labels(self.labels, k, 'le="%s"' % b)
+                out.append(f"{self.name}_bucket{le} {acc}")
+            le = _fmt_labels(self.labels, k, 'le="+Inf"')
+            out.append(f"{self.name}_bucket{le} {s[-1]}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, k)} {s[-2]}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, k)} {s[-1]}")
+        return out
+
+
+class Gauge(_Metric):
+    # nilai diambil saat scrape lewat callback, jadi tidak ada biaya di hot path
+    kind = "gauge"
+
+    def __init__(self, name, help, fn: Callable[[], float]):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        return self._header() + [f"{self.name} {float(self.fn())}"]
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in REGISTRY:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    # header Server-Timing: "decode;dur=12.3, detect;dur=40.1" (ms)
+    return ", ".join(f"{k};dur={v * 1000.0:.1f}" for k, v in timings.items())
@@ -0,0 +1,454 @@
+# store.py — packed embedding store: satu file vektor (mmap) + manifest ringkas
+#
+# Layout di <EMB_DIR>/_packed/:
+#   vectors.f32    baris float32 (DIM) berurutan, append-only
+#   manifest.tsv   "+\t<name>\t<key>"  -> satu baris vektor (row = urutan "+")
+#                  "-\t<name>\t<upto>" -> tombstone: semua row <name> < upto mati
+#                  "~\t<name>\t<row>"  -> tombstone satu row (key yang fotonya diganti)
+#
+#   vectors.f16 / vectors.i8 + quant.json
+#                  opsional (mode compact): mirror baris yang sama dalam float16
+#                  atau int8 (skala per dimensi); vectors.f32 tetap sumber asli
+#                  dan hanya dibaca untuk re-check exact.
+#   generation     2 x int64 (mmap, dibaca semua worker): [generation, epoch].
+#                  generation naik setiap append/delete, epoch naik saat
+#                  compact (nomor baris berubah -> pembaca harus load ulang).
+#   .lock          lock antar proses untuk penulis (beberapa worker uvicorn).
+#
+# Nama orang tidak peka huruf besar/kecil, sama seperti folder embeddings/<nama>/
+# di Windows: append memakai ejaan yang sudah ada ("Dinda" dari folder lama
+# tetap "Dinda" walau enroll mengirim "dinda"), delete mengenai semua ejaan.
+#
+# Layout lama (embeddings/<name>/<key>.npy) tetap bisa dibaca lewat
+# read_legacy(), dan convert_legacy() memindahkannya sekali ke format packed.
+import numpy as np
+from pathlib import Path
+import json, os, sys, threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from gallery import DIM, DTYPES, int8_scale, quantize
+
+PACKED_DIRNAME = "_packed"
+_HEADER = f"#packed-v1\tdim={DIM}\tdtype=float32\n"
+_MIRROR_SUFFIX = {"float16": ".f16", "int8": ".i8"}
+
+
+def _clean(s: str) -> str:
+    return str(s).replace("\t", " ").replace("\n", " ").replace("\r", " ")
+
+
+def _cut_tail(f, size: int):
+    # buang ekor sisa crash (ditulis tapi tidak pernah di-commit di manifest).
+    # Hanya truncate kalau file memang lebih panjang: di Windows truncate gagal
+    # selama ada view mmap yang terbuka ke file ini
+    f.seek(0, os.SEEK_END)
+    if f.tell() > size:
+        f.truncate(size)
+
+
+@contextmanager
+def _file_lock(path: Path):
+    # lock eksklusif antar proses; blocking
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK menyerah setelah ~10 detik; coba lagi
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class PackedStore:
+    def __init__(self, root: Path, dim: int = DIM, compact: str = "float32"):
+        self.root = Path(root)
+        self.dim = dim
+        self.vec_path = self.root / "vectors.f32"
+        self.man_path = self.root / "manifest.tsv"
+        self._row_bytes = dim * 4
+        self._lock = threading.Lock()
+        # mode compact: mirror dtype kecil di samping vectors.f32
+        self.compact_mode = compact
+        self.compact_dtype = DTYPES[compact]
+        self.mirror_path = self.root / f"vectors{_MIRROR_SUFFIX[compact]}" if compact != "float32" else None
+        self.quant_path = self.root / "quant.json"
+        self.gen_path = self.root / "generation"
+        self.lock_path = self.root / ".lock"
+        self.scale: Optional[np.ndarray] = None
+        self._gen: Optional[np.memmap] = None
+        # isi manifest yang sudah dibaca (dipakai append/delete/keys_of):
+        # (epoch, offset, jumlah baris) + baris hidup per nama -> key -> [row].
+        # Tiap tulis cukup membaca ekor manifest sejak offset (tulisan proses lain).
+        self._pos: Optional[Tuple[int, int, int]] = None
+        self._live: Dict[str, Dict[str, List[int]]] = {}
+        self._spellings: Dict[str, List[str]] = {}  # nama.lower() -> ejaan yang hidup
+
+    def exists(self) -> bool:
+        return self.man_path.exists()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, _file_lock(self.lock_path):
+            yield
+
+    def _create(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        if not self.man_path.exists():
+            self.vec_path.write_bytes(b"")
+            self.man_path.write_text(_HEADER, encoding="utf-8")
+        self._init_gen()
+
+    def _init_gen(self):
+        try:
+            with open(self.gen_path, "xb") as f:  # exclusive: hanya satu proses yang membuat
+                f.write(np.zeros(2, dtype=np.int64).tobytes())
+        except FileExistsError:
+            pass
+
+    # ---------- generation counter (dibagi antar proses lewat mmap) ----------
+    def _gen_map(self) -> Optional[np.memmap]:
+        if self._gen is None:
+            if not self.gen_path.exists():
+                if not self.exists():
+                    return None
+                self._init_gen()  # store lama: file generation belum ada
+            self._gen = np.memmap(str(self.gen_path), dtype=np.int64, mode="r+", shape=(2,))
+        return self._gen
+
+    def generation(self) -> Tuple[int, int]:
+        # -> (generation, epoch); (0, 0) kalau store belum ada. Murah: satu baca mmap.
+        g = self._gen_map()
+        return (0, 0) if g is None else (int(g[0]), int(g[1]))
+
+    def _bump(self, epoch: bool = False):
+        # panggil dengan _locked() dipegang, SETELAH data + manifest tertulis
+        g = self._gen_map()
+        g[0] += 1
+        if epoch:
+            g[1] += 1
+
+    # ---------- manifest ----------
+    def tail(self, offset: int) -> Tuple[List[Tuple[str, str, str]], int]:
+        # baris manifest lengkap mulai byte offset -> ([(op, name, arg)], offset baru).
+        # Baris terakhir setengah jadi (crash / sedang ditulis) belum dihitung.
+        with open(self.man_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        ops = []
+        for line in data[:end].decode("utf-8").split("\n"):
+            parts = line.split("\t")
+            if parts[0] in ("+", "-", "~") and len(parts) == 3:
+                ops.append((parts[0], parts[1], parts[2]))
+        return ops, offset + end
+
+    def _read_manifest(self) -> Tuple[List[str], List[str], np.ndarray]:
+        names, keys, alive, _ = self._read_manifest_at()
+        return names, keys, alive
+
+    def _read_manifest_at(self) -> Tuple[List[str], List[str], np.ndarray, int]:
+        names: List[str] = []
+        keys: List[str] = []
+        tomb: Dict[str, int] = {}
+        dead: List[int] = []
+        ops, end = self.tail(0)
+        for op, name, arg in ops:
+            if op == "+":
+                names.append(name)
+                keys.append(arg)
+            elif op == "~":
+                dead.append(int(arg))
+            else:
+                tomb[name] = max(tomb.get(name, 0), int(arg))
+        alive = np.ones(len(names), dtype=bool)
+        alive[dead] = False
+        if tomb:
+            for i, n in enumerate(names):
+                upto = tomb.get(n)
+                if upto is not None and i < upto:
+                    alive[i] = False
+        return names, keys, alive, end
+
+    def _advance(self) -> int:
+        # panggil dengan _locked() dipegang; -> jumlah baris di store.
+        # compact (epoch berubah) -> nomor baris lain, baca ulang dari awal.
+        epoch = self.generation()[1]
+        if self._pos is None or self._pos[0] != epoch:
+            self._pos, self._live, self._spellings = (epoch, 0, 0), {}, {}
+        _, offset, n = self._pos
+        ops, offset = self.tail(offset)
+        for op, name, arg in ops:
+            if op == "+":
+                if name not in self._live:
+                    self._spellings.setdefault(name.lower(), []).append(name)
+                self._live.setdefault(name, {}).setdefault(arg, []).append(n)
+                n += 1
+            elif op == "~":
+                ks = self._live.get(name, {})
+                for key, rows in list(ks.items()):
+                    if int(arg) in rows:
+                        rows.remove(int(arg))
+                        if not rows:
+                            del ks[key]
+                if not ks:
+                    self._forget(name)
+            else:
+                self._forget(name)  # tombstone "-": semua row nama ini < upto
+        self._pos = (epoch, offset, n)
+        return n
+
+    def _forget(self, name: str):
+        if self._live.pop(name, None) is None:
+            return
+        same = self._spellings[name.lower()]
+        same.remove(name)
+        if not same:
+            del self._spellings[name.lower()]
+
+    def _spelling(self, name: str) -> str:
+        # ejaan nama yang sudah hidup di store (case-insensitive), kalau ada
+        return self._spellings.get(name.lower(), [name])[0]
+
+    def _map_vectors(self, n: int) -> np.ndarray:
+        if n == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        have = self.vec_path.stat().st_size // self._row_bytes
+        if have < n:
+            raise RuntimeError(f"{self.vec_path}: {have} rows on disk, manifest has {n}")
+        return np.memmap(str(self.vec_path), dtype=np.float32, mode="r", shape=(n, self.dim))
+
+    def load(self) -> Tuple[List[str], List[str], np.ndarray, np.ndarray, Tuple[int, int]]:
+        # -> (names, keys, vecs, rows, pos) hanya untuk baris yang masih hidup.
+        # vecs salinan di RAM (float32, atau dtype compact); rows = nomor baris
+        # di vectors.f32 untuk read_rows(). memmap langsung dilepas.
+        # pos = (offset manifest, jumlah baris) untuk tail() berikutnya.
+        with self._locked():
+            names, keys, alive, end = self._read_manifest_at()
+            mm = self._map_rows(len(names))
+            vecs = np.array(mm[alive], dtype=mm.dtype)
+            del mm
+        idx = np.flatnonzero(alive)
+        return [names[i] for i in idx], [keys[i] for i in idx], vecs, idx, (end, len(names))
+
+    def load_mapped(self) -> Tuple[List[str], np.ndarray, np.ndarray, Tuple[int, int]]:
+        # -> (names, alive, mm, pos) untuk SEMUA baris: mm tetap terbuka (read-only),
+        # jadi beberapa worker berbagi page cache yang sama, tanpa salinan per proses.
+        with self._locked():
+            names, _, alive, end = self._read_manifest_at()
+            mm = self._map_rows(len(names))
+        return names, alive, mm, (end, len(names))
+
+    def map_rows(self, n: int) -> np.ndarray:
+        # n baris pertama dalam dtype galeri (mirror compact kalau ada)
+        with self._locked():
+            return self._map_rows(n)
+
+    def _map_rows(self, n: int) -> np.ndarray:
+        if self.mirror_path is not None:
+            self._sync_mirror(n)
+            return self._map_mirror(n)
+        return self._map_vectors(n)
+
+    def read_rows(self, rows: np.ndarray) -> np.ndarray:
+        # float32 asli untuk baris tertentu (re-check exact di mode compact)
+        rows = np.asarray(rows, dtype=np.int64)
+        n = int(rows.max()) + 1 if len(rows) else 0
+        mm = self._map_vectors(n)
+        out = np.array(mm[rows], dtype=np.float32)
+        del mm
+        return out
+
+    # ---------- mirror compact ----------
+    def _mirror_rows(self) -> int:
+        if not self.mirror_path.exists():
+            return 0
+        return self.mirror_path.stat().st_size // (self.dim * np.dtype(self.compact_dtype).itemsize)
+
+    def _map_mirror(self, n: int) -> np.ndarray:
+        if n == 0:
+            return np.empty((0, self.dim), dtype=self.compact_dtype)
+        return np.memmap(str(self.mirror_path), dtype=self.compact_dtype, mode="r", shape=(n, self.dim))
+
+    def _load_scale(self, n: int):
+        if self.compact_dtype != np.int8 or self.scale is not None:
+            return
+        if self.quant_path.exists():
+            self.scale = np.asarray(json.loads(self.quant_path.read_text())["scale"], dtype=np.float32)
+            return
+        # skala dihitung sekali dari data yang ada, lalu dipakai tetap
+        mm = self._map_vectors(n)
+        self.scale = int8_scale(np.asarray(mm))
+        del mm
+        self.quant_path.write_text(json.dumps({"dtype": "int8", "scale": self.scale.tolist()}))
+        if self.mirror_path.exists():
+            self.mirror_path.unlink()  # mirror lama tanpa skala ini tidak valid
+
+    def _quantize(self, vecs: np.ndarray) -> np.ndarray:
+        return quantize(vecs, self.compact_dtype, self.scale)
+
+    def _sync_mirror(self, n: int):
+        # lengkapi mirror sampai n baris dari vectors.f32 (mis. mode baru dinyalakan)
+        self._create()
+        self._load_scale(n)
+        have = self._mirror_rows()
+        if have >= n:
+            return
+        mm = self._map_vectors(n)
+        with open(self.mirror_path, "ab") as f:
+            _cut_tail(f, have * self.dim * np.dtype(self.compact_dtype).itemsize)  # baris terpotong
+            for s in range(have, n, 65536):
+                f.write(self._quantize(mm[s:min(s + 65536, n)]).tobytes())
+        del mm
+
+    def keys_of(self) -> Set[Tuple[str, str]]:
+        with self._locked():
+            self._advance()
+            return {(name, key) for name, ks in self._live.items() for key in ks}
+
+    def append(self, names: List[str], keys: List[str], vecs: np.ndarray, replace: bool = False) -> List[int]:
+        # replace=True: row lama dengan (name, key) yang sama di-tombstone ("~")
+        # di commit manifest yang sama, jadi hanya vektor baru yang hidup
+        arr = np.ascontiguousarray(np.asarray(vecs, dtype=np.float32).reshape(-1, self.dim))
+        if len(arr) != len(names) or len(names) != len(keys):
+            raise ValueError("names/keys/vecs length mismatch")
+        with self._locked():
+            self._create()
+            n0 = self._advance()
+            first: Dict[str, str] = {}  # satu ejaan per nama, juga di dalam batch ini
+            names = [first.setdefault(n.lower(), self._spelling(n)) for n in map(_clean, names)]
+            # vektor dulu, manifest belakangan: manifest = commit record
+            end = n0 + len(arr)
+            with open(self.vec_path, "r+b") as f:
+                f.seek(n0 * self._row_bytes)
+                f.write(arr.tobytes())
+                _cut_tail(f, end * self._row_bytes)
+                f.flush()
+                os.fsync(f.fileno())
+            # mirror: sisa crash sesudah n0 ditimpa/dipotong dulu, kalau tidak
+            # _sync_mirror menganggapnya sudah lengkap dan vektor basi ikut terbaca.
+            # Mirror yang tertinggal (< n0) dilengkapi _sync_mirror saat load
+            if self.mirror_path is not None and self._mirror_rows() >= n0:
+                mrow = self.dim * np.dtype(self.compact_dtype).itemsize
+                with open(self.mirror_path, "r+b" if self.mirror_path.exists() else "wb") as f:
+                    if self.compact_dtype != np.int8 or self.scale is not None:
+                        f.seek(n0 * mrow)
+                        f.write(self._quantize(arr).tobytes())
+                        _cut_tail(f, end * mrow)
+                    else:
+                        _cut_tail(f, n0 * mrow)  # skala int8 belum ada: baris baru menyusul lewat _sync_mirror
+            old = []  # (name, row) hidup yang diganti
+            if replace:
+                for n, k in zip(names, keys):
+                    old += [(n, r) for r in self._live.get(n, {}).get(_clean(k), [])]
+            with open(self.man_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"~\t{n}\t{r}\n" for n, r in old)
+                        + "".join(f"+\t{n}\t{_clean(k)}\n" for n, k in zip(names, keys)))
+                f.flush()
+                os.fsync(f.fileno())
+            self._bump()
+        return list(range(n0, end))
+
+    def delete(self, name: str) -> int:
+        with self._locked():
+            if not self.exists():
+                return 0
+            n = self._advance()
+            same = list(self._spellings.get(_clean(name).lower(), []))
+            killed = sum(len(rows) for s in same for rows in self._live[s].values())
+            if killed:
+                with open(self.man_path, "a", encoding="utf-8") as f:
+                    f.write("".join(f"-\t{s}\t{n}\n" for s in same))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._bump()
+            return killed
+
+    def compact(self) -> Dict[str, int]:
+        # tulis ulang tanpa baris mati, lalu ganti file secara atomik
+        with self._locked():
+            names, keys, alive = self._read_manifest()
+            mm = self._map_vectors(len(names))
+            vecs = np.array(mm[alive], dtype=np.float32)
+            del mm
+            tmp_v = self.vec_path.with_suffix(".f32.tmp")
+            tmp_m = self.man_path.with_suffix(".tsv.tmp")
+            tmp_v.write_bytes(vecs.tobytes())
+            with open(tmp_m, "w", encoding="utf-8") as f:
+                f.write(_HEADER)
+                for i in np.flatnonzero(alive):
+                    f.write(f"+\t{names[i]}\t{keys[i]}\n")
+            os.replace(tmp_v, self.vec_path)
+            os.replace(tmp_m, self.man_path)
+            for suf in _MIRROR_SUFFIX.values():
+                mirror = self.root / f"vectors{suf}"
+                if mirror.exists():
+                    mirror.unlink()  # nomor baris berubah; dibangun ulang saat load
+            self._bump(epoch=True)
+        return {"kept": int(alive.sum()), "dropped": int((~alive).sum())}
+
+
+# ---------- Layout lama: satu .npy per vektor ----------
+def iter_legacy(emb_dir: Path) -> Iterator[Tuple[str, str, np.ndarray]]:
+    for p in sorted(emb_dir.iterdir()):
+        if not p.is_dir() or p.name.startswith("_"):
+            continue
+        for f in sorted(p.iterdir()):
+            if f.suffix.lower() == ".npy":
+                try:
+                    yield p.name, f.stem, np.load(str(f))
+                except Exception as e:
+                    print(f"[LOAD][ERROR] {f}: {e}")
+
+
+def read_legacy(emb_dir: Path) -> Tuple[List[str], List[str], np.ndarray]:
+    names, keys, vecs = [], [], []
+    for name, key, v in iter_legacy(emb_dir):
+        names.append(name)
+        keys.append(key)
+        vecs.append(np.asarray(v, dtype=np.float32).ravel())
+    arr = np.stack(vecs) if vecs else np.empty((0, DIM), dtype=np.float32)
+    return names, keys, arr
+
+
+def convert_legacy(emb_dir: Path, store: PackedStore) -> int:
+    # one-time: embeddings/<name>/*.npy -> _packed/; file lama tidak dihapus
+    have = store.keys_of() if store.exists() else set()
+    names, keys, vecs = read_legacy(emb_dir)
+    keep = [i for i in range(len(names)) if (names[i], keys[i]) not in have]
+    if keep:
+        store.append([names[i] for i in keep], [keys[i] for i in keep], vecs[keep])
+    elif not store.exists():
+        store._create()
+    return len(keep)
+
+
+if __name__ == "__main__":
+    # python store.py convert|compact [EMB_DIR]
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "convert"
+    emb = Path(sys.argv[2]) if len(sys.argv) > 2 else Path(__file__).resolve().parent / "embeddings"
+    st = PackedStore(emb / PACKED_DIRNAME)
+    if cmd == "convert":
+        print(f"[CONVERT] added={convert_legacy(emb, st)} store={st.root}")
+    elif cmd == "compact":
+        print(f"[COMPACT] {st.compact()}")
+    else:
+        sys.exit("usage: python store.py convert|compact [EMB_DIR]")